@@ -8,7 +8,12 @@ from serializers.fields import (
     RelatedField,
     PrimaryKeyRelatedField,
     NaturalKeyRelatedField,
-    ModelNameField
+    ModelNameField,
+    CountField,
+    SumField,
+    register_type,
+    unregister_type
 )
+from serializers.warmup import warm_up
 
 __version__ = '0.4.0'
@@ -0,0 +1,202 @@
+"""
+Generates specialized functions for serializing objects with a given field
+plan, for serializers that set the `compile` option.
+
+The generated functions read attributes directly from the object, and build
+the output dict in one go, rather than calling through `_serialize_field`,
+`serialize_field` and `serialize` for every field of every object.  Any
+fields that have custom behaviour are still serialized by calling the field.
+"""
+from django.db.models.fields import Field as DatabaseField
+from django.utils.encoding import is_protected_type, smart_unicode
+from serializers.fields import (
+    Field,
+    ModelField,
+    PrimaryKeyRelatedField,
+    ModelNameField,
+    _field_converters,
+    _identity
+)
+from serializers.utils import DictWithMetadata, SortedDictWithMetadata
+import datetime
+import decimal
+import keyword
+import re
+import types
+
+
+_identifier = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Compiled code, keyed by its source, so that serializer instances with the
+# same plans only compile it once per process.
+_compiled_code = {}
+
+# Exact types which `is_protected_type` is true for.
+_protected_classes = frozenset([
+    types.NoneType, bool, int, long, float, decimal.Decimal,
+    datetime.datetime, datetime.date, datetime.time
+])
+
+
+def _get_attribute(name):
+    """
+    Return the expression for reading an attribute from `obj`.
+    """
+    if _identifier.match(name) and not keyword.iskeyword(name):
+        return 'obj.%s' % name
+    return 'getattr(obj, %r)' % name
+
+
+def _exec(source, namespace):
+    """
+    Execute generated source in the given namespace, reusing the compiled
+    code if the same source has been compiled before.
+    """
+    try:
+        code = _compiled_code[source]
+    except KeyError:
+        code = compile(source, '<serializer plan>', 'exec')
+        _compiled_code[source] = code
+    exec(code, namespace)
+
+
+def _get_model_field(obj, field_name):
+    """
+    Return the concrete model field with the given name, or `None`.
+    """
+    try:
+        field, model, direct, m2m = obj._meta.get_field_by_name(field_name)
+    except Exception:
+        return None
+    if not direct or m2m:
+        return None
+    return field
+
+
+def _compile_field(index, field_name, field, obj, namespace):
+    """
+    Return the lines of code that set `v<index>` to the serialized value of
+    a single field.
+    """
+    var = 'v%d' % index
+    field_var = '_f%d' % index
+    namespace[field_var] = field
+    generic = ['%s = %s._serialize_field(obj, %r, serializer)' %
+               (var, field_var, field_name)]
+
+    name = field.source or field_name
+    if ('serialize' in field.__dict__ or field.memoize is not None or
+        name == '*' or '.' in name):
+        return generic
+
+    # The generic path sets these on every call, but they only depend on
+    # the model, and are used by `attributes()` when rendering xml.
+    field.obj = obj
+    field.field_name = name
+    cls = field.__class__
+
+    if cls is Field:
+        return [
+            '%s = %s' % (var, _get_attribute(name)),
+            'if _converter(%s.__class__) is not _identity:' % var,
+            '    %s = %s.serialize(%s)' % (var, field_var, var),
+        ]
+
+    elif cls is ModelField:
+        model_field = _get_model_field(obj, name)
+        if model_field is None or model_field.rel:
+            return generic
+        get_val = model_field.__class__._get_val_from_obj.im_func
+        if get_val is not DatabaseField._get_val_from_obj.im_func:
+            return generic
+        field.field = model_field
+        namespace['_mf%d' % index] = model_field
+        return [
+            '%s = %s' % (var, _get_attribute(model_field.attname)),
+            'if %s.__class__ not in _protected and not _is_protected(%s):' % (var, var),
+            '    %s = _mf%d.value_to_string(obj)' % (var, index),
+        ]
+
+    elif cls is PrimaryKeyRelatedField:
+        model_field = _get_model_field(obj, name)
+        if model_field is None:
+            return generic
+        return ['%s = %s' % (var, _get_attribute(model_field.attname))]
+
+    elif cls is ModelNameField:
+        namespace['_c%d' % index] = smart_unicode(obj._meta)
+        return ['%s = _c%d' % (var, index)]
+
+    return generic
+
+
+def compile_values(plan, obj, skip=()):
+    """
+    Return a function `plan_values(serializer, obj)` that returns a tuple of
+    the serialized value of each field in the plan, in order.  Any indexes in
+    `skip` are left as `None`, for the caller to fill in.
+    """
+    namespace = {
+        '_converter': _field_converters.get,
+        '_identity': _identity,
+        '_protected': _protected_classes,
+        '_is_protected': is_protected_type,
+    }
+
+    lines = ['def plan_values(serializer, obj):']
+    for index, (field_name, key, field) in enumerate(plan):
+        if index in skip:
+            lines.append('    v%d = None' % index)
+            continue
+        for line in _compile_field(index, field_name, field, obj, namespace):
+            lines.append('    ' + line)
+    values = ''.join(['v%d, ' % index for index in range(len(plan))])
+    lines.append('    return (%s)' % values)
+
+    _exec('\n'.join(lines) + '\n', namespace)
+    return namespace['plan_values']
+
+
+def compile_plan(serializer, plan, obj):
+    """
+    Return a function `serialize_plan(serializer, obj)` that serializes
+    objects with the given field plan, equivalently to `serialize_object`.
+    """
+    namespace = {
+        '_converter': _field_converters.get,
+        '_identity': _identity,
+        '_protected': _protected_classes,
+        '_is_protected': is_protected_type,
+        '_dict_update': dict.update,
+    }
+
+    keys = []
+    metadata = {}
+    lines = ['def serialize_plan(serializer, obj):']
+    items = []
+    for index, (field_name, key, field) in enumerate(plan):
+        for line in _compile_field(index, field_name, field, obj, namespace):
+            lines.append('    ' + line)
+        namespace['_k%d' % index] = key
+        items.append('(_k%d, v%d)' % (index, index))
+        if key not in metadata:
+            keys.append(key)
+        metadata[key] = field
+
+    if serializer._use_sorted_dict:
+        namespace['_dict_class'] = SortedDictWithMetadata
+    else:
+        namespace['_dict_class'] = DictWithMetadata
+    namespace['_keys'] = keys
+    namespace['_metadata'] = metadata
+
+    lines.append('    ret = _dict_class()')
+    if items:
+        lines.append('    _dict_update(ret, (%s,))' % ', '.join(items))
+    if serializer._use_sorted_dict:
+        lines.append('    ret.keyOrder = _keys[:]')
+    lines.append('    ret.metadata = _metadata.copy()')
+    lines.append('    return ret')
+
+    _exec('\n'.join(lines) + '\n', namespace)
+    return namespace['serialize_plan']
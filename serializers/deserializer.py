@@ -0,0 +1,394 @@
+"""
+Bulk loading of dumpdata formatted json, yaml and xml.
+
+Records are read from the input stream one at a time, grouped by model, and
+inserted using batched `bulk_create` calls, rather than calling `save()` once
+per object.  Many to many relationships are inserted directly into their
+through tables, and natural keys are resolved using batched lookups.
+"""
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.color import no_style
+from django.core.serializers.base import DeserializationError
+from django.db import connections, models, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils import simplejson as json
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import smart_unicode
+from xml.dom import pulldom
+import operator
+import StringIO
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+_JSON_SEPARATORS = ' \t\r\n[],'
+
+
+def _iter_json_records(stream, chunk_size=64 * 1024):
+    """
+    Yield each object in a json list, reading the stream in chunks.
+    Also handles files containing one json object per line.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos = '', 0
+    while True:
+        while pos < len(buf) and buf[pos] in _JSON_SEPARATORS:
+            pos += 1
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # The next record is incomplete, so we need to read more data.
+            data = stream.read(chunk_size)
+            if not data:
+                if buf[pos:].strip(_JSON_SEPARATORS):
+                    raise DeserializationError("Invalid json record")
+                return
+            buf, pos = buf[pos:] + data, 0
+            continue
+        yield record
+
+
+def _iter_yaml_records(stream):
+    """
+    Yield each object in a yaml list.  Items in a block style list each
+    start with '- ' at the start of a line, so may be loaded one at a time.
+    """
+    lines = []
+    for line in stream:
+        if line.startswith('- ') and lines:
+            for record in yaml.safe_load(''.join(lines)):
+                yield record
+            lines = []
+        lines.append(line)
+    if lines:
+        for record in yaml.safe_load(''.join(lines)) or []:
+            yield record
+
+
+def _get_inner_text(node):
+    text = []
+    for child in node.childNodes:
+        if child.nodeType in (child.TEXT_NODE, child.CDATA_SECTION_NODE):
+            text.append(child.data)
+        elif child.nodeType == child.ELEMENT_NODE:
+            text.append(_get_inner_text(child))
+    return u''.join(text)
+
+
+def _get_xml_value(node):
+    """
+    Return the value of a single <field> or related <object> node, as it
+    would be represented in json.
+    """
+    if node.getElementsByTagName('None'):
+        return None
+    natural = node.getElementsByTagName('natural')
+    if natural:
+        return [_get_inner_text(item) for item in natural]
+    if node.hasAttribute('pk'):
+        return node.getAttribute('pk')
+    return _get_inner_text(node)
+
+
+def _iter_xml_records(stream):
+    """
+    Yield each <object> in an xml document, as it would be represented in json.
+    """
+    events = pulldom.parse(stream)
+    for event, node in events:
+        if event != 'START_ELEMENT' or node.nodeName != 'object':
+            continue
+        events.expandNode(node)
+        fields = {}
+        for field in node.getElementsByTagName('field'):
+            if field.getAttribute('rel') == 'ManyToManyRel':
+                value = [_get_xml_value(item)
+                         for item in field.getElementsByTagName('object')]
+            else:
+                value = _get_xml_value(field)
+            fields[field.getAttribute('name')] = value
+        yield {
+            'model': node.getAttribute('model'),
+            'pk': node.getAttribute('pk') or None,
+            'fields': fields
+        }
+
+
+def _get_model(label):
+    try:
+        model = models.get_model(*label.split('.'))
+    except (TypeError, ValueError):
+        model = None
+    if model is None:
+        raise DeserializationError("Invalid model identifier: '%s'" % label)
+    return model
+
+
+def _is_natural_key(field, value):
+    return (hasattr(field.rel.to._default_manager, 'get_by_natural_key') and
+            hasattr(value, '__iter__'))
+
+
+def _natural_key(value):
+    return tuple([smart_unicode(item) for item in value])
+
+
+def _get_natural_key_candidates(model):
+    """
+    Return the tuples of non-relational fields that are unique together for
+    a model, any of which its natural key may consist of.
+    """
+    ret = []
+    for field in model._meta.local_fields:
+        if field.unique and not field.primary_key and not field.rel:
+            ret.append((field.name,))
+    for names in model._meta.unique_together:
+        if not [name for name in names if model._meta.get_field(name).rel]:
+            ret.append(tuple(names))
+    return ret
+
+
+def _get_related_value(field, obj):
+    """
+    Return the value that should be stored for a related object.
+    """
+    value = getattr(obj, field.rel.field_name)
+    if field.rel.to._meta.pk.rel:
+        value = value.pk
+    return value
+
+
+class BulkDeserializer(object):
+    """
+    Loads the dumpdata formatted output of `DumpDataSerializer`.
+
+    Note that objects are inserted without calling `save()`, so no signals
+    are sent, and that objects are expected not to exist in the database yet.
+    """
+    record_readers = {
+        'json': _iter_json_records,
+        'yaml': _iter_yaml_records,
+        'xml': _iter_xml_records,
+    }
+
+    def __init__(self, batch_size=1000, using=DEFAULT_DB_ALIAS):
+        self.batch_size = batch_size
+        self.using = using
+
+    def load(self, stream, format):
+        """
+        Load the objects in the given stream or string, returning the number
+        of objects that were loaded.
+        """
+        if format == 'yaml' and yaml is None:
+            raise DeserializationError("yaml is not installed")
+        if isinstance(stream, basestring):
+            stream = StringIO.StringIO(stream)
+
+        self.pending = SortedDict()
+        self.flushing = {}
+        self.natural_key_fields = {}
+        self.loaded_models = set()
+        count = 0
+        connection = connections[self.using]
+        with transaction.commit_on_success(using=self.using):
+            # As for `loaddata`, objects may refer to objects that are
+            # inserted after them, so constraints are checked at the end.
+            with connection.constraint_checks_disabled():
+                for record in self.record_readers[format](stream):
+                    self.add_record(record)
+                    count += 1
+                for model in self.pending.keys():
+                    self.flush(model)
+            connection.check_constraints(table_names=[
+                model._meta.db_table for model in self.loaded_models
+            ])
+            self.reset_sequences()
+        return count
+
+    def add_record(self, record):
+        """
+        Convert a single dumpdata record into model field values, and add it
+        to the pending batch for its model.
+        """
+        model = _get_model(record['model'])
+        pk_field = model._meta.pk
+        data = {pk_field.attname: pk_field.to_python(record.get('pk'))}
+        natural = {}
+        m2m = {}
+
+        for field_name, value in record['fields'].iteritems():
+            field = model._meta.get_field(field_name)
+            if field.rel and isinstance(field.rel, models.ManyToManyRel):
+                if field.rel.through._meta.auto_created:
+                    m2m[field] = value
+            elif field.rel and isinstance(field.rel, models.ManyToOneRel):
+                if value is None:
+                    data[field.attname] = None
+                elif _is_natural_key(field, value):
+                    natural[field] = _natural_key(value)
+                else:
+                    to_field = field.rel.to._meta.get_field(field.rel.field_name)
+                    data[field.attname] = to_field.to_python(value)
+            else:
+                data[field.name] = field.to_python(value)
+
+        batch = self.pending.setdefault(model, [])
+        batch.append((data, natural, m2m))
+        if len(batch) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model):
+        """
+        Insert the pending batch of objects for a model.
+        """
+        batch = self.pending.pop(model, None)
+        if not batch:
+            return
+
+        # Collect every natural key used by the batch.  Any pending objects
+        # that those keys could refer to are inserted first.  While they are,
+        # this batch's own objects are kept in `flushing`, so that models
+        # that refer back to this one, or to themselves, may resolve natural
+        # keys against them, rather than the database.
+        objs = [model(**data) for data, natural, m2m in batch]
+        keys = {}
+        for data, natural, m2m in batch:
+            for field, key in natural.items():
+                keys.setdefault(field.rel.to, set()).add(key)
+            for field, values in m2m.items():
+                for value in values:
+                    if _is_natural_key(field, value):
+                        keys.setdefault(field.rel.to, set()).add(_natural_key(value))
+        self.flushing[model] = objs
+        try:
+            for related_model in keys:
+                if related_model is not model:
+                    self.flush(related_model)
+            resolved = dict([
+                (related_model, self.resolve_natural_keys(related_model, related_keys))
+                for related_model, related_keys in keys.items()
+            ])
+        finally:
+            del self.flushing[model]
+
+        for obj, (data, natural, m2m) in zip(objs, batch):
+            for field, key in natural.items():
+                related = resolved[field.rel.to][key]
+                setattr(obj, field.attname, _get_related_value(field, related))
+        self.save_objects(model, objs)
+
+        through_objs = SortedDict()
+        for data, natural, m2m in batch:
+            pk = data[model._meta.pk.attname]
+            for field, values in m2m.items():
+                through = field.rel.through
+                source = through._meta.get_field(field.m2m_field_name()).attname
+                target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+                rows = through_objs.setdefault(through, [])
+                for value in values:
+                    if _is_natural_key(field, value):
+                        value = resolved[field.rel.to][_natural_key(value)].pk
+                    else:
+                        value = field.rel.to._meta.pk.to_python(value)
+                    rows.append(through(**{source: pk, target: value}))
+        for through, rows in through_objs.items():
+            self.save_objects(through, rows)
+
+    def save_objects(self, model, objs):
+        """
+        Insert a list of objects.  Inherited models can't be bulk created,
+        so are saved individually.
+        """
+        if model._meta.parents:
+            for obj in objs:
+                models.Model.save_base(obj, using=self.using, raw=True)
+        else:
+            model._default_manager.db_manager(self.using).bulk_create(objs)
+        self.loaded_models.add(model)
+
+    def resolve_natural_keys(self, model, keys):
+        """
+        Return a dict mapping natural keys to instances of the model.
+
+        Keys are looked up in batches, filtering on the fields that the
+        natural key consists of.  Those are given by the model's
+        `natural_key_fields` attribute, if declared.  Otherwise they are
+        found by looking up the first key with `get_by_natural_key`, and
+        checking which of the model's unique fields, or `unique_together`
+        fields, give the same key.  Any keys that can't be looked up in
+        batches are looked up individually with `get_by_natural_key`.
+        """
+        manager = model._default_manager.db_manager(self.using)
+        keys = set(keys)
+        resolved = {}
+
+        pending = self.flushing.get(model)
+        if pending:
+            for obj in pending:
+                try:
+                    key = _natural_key(obj.natural_key())
+                except ObjectDoesNotExist:
+                    # Natural keys that include unresolved relationships.
+                    continue
+                if key in keys:
+                    resolved[key] = obj
+            keys.difference_update(resolved)
+
+        field_names = self.get_natural_key_fields(model, keys, resolved)
+        keys.difference_update(resolved)
+        if field_names:
+            # Keep the number of query parameters within database limits.
+            keys = list(keys)
+            batch_size = max(1, 500 // len(field_names))
+            for index in range(0, len(keys), batch_size):
+                query = reduce(operator.or_, [
+                    Q(**dict(zip(field_names, key)))
+                    for key in keys[index:index + batch_size]
+                ])
+                for obj in manager.filter(query):
+                    key = _natural_key([getattr(obj, name) for name in field_names])
+                    resolved[key] = obj
+
+        for key in keys:
+            if key not in resolved:
+                resolved[key] = manager.get_by_natural_key(*key)
+        return resolved
+
+    def get_natural_key_fields(self, model, keys, resolved):
+        """
+        Return the names of the fields that a model's natural key consists
+        of, or `None` if they aren't known.  If the first key has to be looked
+        up to find them, then it is added to `resolved`.
+        """
+        try:
+            return self.natural_key_fields[model]
+        except KeyError:
+            pass
+        field_names = getattr(model, 'natural_key_fields', None)
+        if field_names is None and keys:
+            key = iter(keys).next()
+            obj = model._default_manager.db_manager(self.using).get_by_natural_key(*key)
+            resolved[key] = obj
+            for names in _get_natural_key_candidates(model):
+                if (len(names) == len(key) and
+                    _natural_key([getattr(obj, name) for name in names]) == key):
+                    field_names = names
+                    break
+        elif field_names is None:
+            return None
+        self.natural_key_fields[model] = field_names
+        return field_names
+
+    def reset_sequences(self):
+        """
+        Reset the database sequences for any loaded models, as `loaddata` does.
+        """
+        connection = connections[self.using]
+        sql = connection.ops.sequence_reset_sql(no_style(), list(self.loaded_models))
+        if sql:
+            cursor = connection.cursor()
+            for line in sql:
+                cursor.execute(line)
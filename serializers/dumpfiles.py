@@ -0,0 +1,154 @@
+"""
+Indexed dump files, that allow individual objects to be read back from a
+large dump without having to parse the complete file.
+
+The dump file contains one dumpdata formatted JSON record per line.  The
+sidecar index file contains one `[model, pk, offset, length]` JSON record per
+line, giving the position of each object's record in the dump file.
+"""
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+from django.core.serializers.python import Deserializer as PythonDeserializer
+from django.utils import simplejson as json
+from django.utils.encoding import smart_unicode
+from serializers.serializer import DumpDataSerializer
+import mmap
+import os
+
+
+_encoder = DateTimeAwareJSONEncoder()
+
+
+def _get_index_path(path, index_path):
+    return index_path or path + '.idx'
+
+
+def _get_model_label(model):
+    """
+    Return the label used in dumpdata records for a model, eg 'auth.user'.
+    Accepts either a model class or a label.
+    """
+    if hasattr(model, '_meta'):
+        return smart_unicode(model._meta)
+    return model
+
+
+def _get_index_key(model, pk):
+    """
+    Return the key of an object in the index.  Primary keys are kept as they
+    are encoded in the dump, so that eg. dates and decimals are strings.
+    """
+    return (_get_model_label(model), json.loads(_encoder.encode(pk)))
+
+
+class IndexedDumpWriter(object):
+    """
+    Writes model instances and querysets to an indexed dump file.
+    """
+    serializer_class = DumpDataSerializer
+
+    def __init__(self, path, index_path=None, use_natural_keys=False):
+        self.serializer = self.serializer_class()
+        if use_natural_keys:
+            self.serializer.enable_natural_keys()
+        self.encoder = DateTimeAwareJSONEncoder()
+        self.stream = open(path, 'wb')
+        self.index_stream = open(_get_index_path(path, index_path), 'wb')
+        self.offset = 0
+
+    def write(self, obj):
+        """
+        Write a model instance, or each instance in a queryset, to the dump.
+        """
+        # Each write is a separate serialization, as for `encode_iter`.
+        self.serializer.stack = []
+        self.serializer.memos = {}
+        records = self.serializer.serialize_iter(obj)
+        if isinstance(records, dict):
+            records = [records]
+        for record in records:
+            data = self.encoder.encode(record)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            self.stream.write(data + '\n')
+            entry = [record['model'], record['pk'], self.offset, len(data)]
+            self.index_stream.write(self.encoder.encode(entry) + '\n')
+            self.offset += len(data) + 1
+
+    def close(self):
+        self.stream.close()
+        self.index_stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class IndexedDumpReader(object):
+    """
+    Reads individual objects from an indexed dump file.  The dump file is
+    memory mapped, and only the requested records are decoded.
+    """
+    def __init__(self, path, index_path=None):
+        self.index = {}
+        index_stream = open(_get_index_path(path, index_path), 'rb')
+        try:
+            for line in index_stream:
+                model, pk, offset, length = json.loads(line)
+                self.index[(model, pk)] = (offset, length)
+        finally:
+            index_stream.close()
+
+        self.stream = open(path, 'rb')
+        if os.fstat(self.stream.fileno()).st_size:
+            self.data = mmap.mmap(self.stream.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self.data = None
+
+    def keys(self):
+        """
+        Return the `(model, pk)` keys of all the objects in the dump.
+        """
+        return self.index.keys()
+
+    def __contains__(self, key):
+        model, pk = key
+        return _get_index_key(model, pk) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, model, pk):
+        """
+        Return the dumpdata record for a single object, given either
+        a model class or a model label, and the object's primary key.
+        Raises `KeyError` if the object is not in the dump.
+        """
+        offset, length = self.index[_get_index_key(model, pk)]
+        return json.loads(self.data[offset:offset + length])
+
+    def get_many(self, keys):
+        """
+        Return the dumpdata records for a list of `(model, pk)` keys.
+        """
+        return [self.get(model, pk) for model, pk in keys]
+
+    def deserialize(self, keys, **options):
+        """
+        Return an iterator of Django `DeserializedObject` instances for a list
+        of `(model, pk)` keys, that may be saved to restore those objects.
+        """
+        return PythonDeserializer(self.get_many(keys), **options)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
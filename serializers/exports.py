@@ -0,0 +1,122 @@
+"""
+Resumable streaming exports of querysets to files.
+
+Objects are exported in primary key order, a chunk at a time.  After each
+chunk, a checkpoint recording the last primary key written, and the size of
+the output so far, is saved alongside the output file.  If the export is
+interrupted, it may be resumed from the last checkpoint, giving output that
+is identical to an uninterrupted export.
+"""
+from django.utils import simplejson as json
+import os
+
+
+def iter_chunks(queryset, chunk_size, after=None):
+    """
+    Yield lists of up to `chunk_size` objects from a queryset, in primary
+    key order, starting after the primary key `after` if given.
+    """
+    queryset = queryset.order_by('pk')
+    while True:
+        chunk = queryset
+        if after is not None:
+            chunk = chunk.filter(pk__gt=after)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        after = chunk[-1].pk
+
+
+def get_checkpoint_path(path):
+    return path + '.checkpoint'
+
+
+def read_checkpoint(path):
+    """
+    Return the checkpoint saved for an export to the given path, as a dict
+    of 'pk', 'offset' and 'count', or `None`.
+    """
+    try:
+        with open(get_checkpoint_path(path), 'rb') as stream:
+            return json.load(stream)
+    except IOError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    """
+    Save a checkpoint, replacing the previous one atomically, so that an
+    interruption while saving leaves the previous checkpoint intact.
+    """
+    checkpoint_path = get_checkpoint_path(path)
+    temp_path = checkpoint_path + '.tmp'
+    with open(temp_path, 'wb') as stream:
+        json.dump(checkpoint, stream)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.rename(temp_path, checkpoint_path)
+
+
+def export(serializer, queryset, path, format, chunk_size=1000,
+           resume=False, progress=None, **opts):
+    """
+    Encode a queryset to the file at `path`, saving a checkpoint after every
+    `chunk_size` objects.  If `resume` is set and a checkpoint exists, then
+    the output is truncated to the checkpoint, and the export continues from
+    there.  `progress` may be a function, called with the number of objects
+    exported so far after each chunk.
+
+    Returns the number of objects exported.  The checkpoint is removed once
+    the export is complete.
+    """
+    pk_field = queryset.model._meta.pk
+    checkpoint = resume and read_checkpoint(path) or None
+    if checkpoint is not None:
+        stream = open(path, 'r+b')
+        stream.seek(checkpoint['offset'])
+        stream.truncate()
+        after = pk_field.to_python(checkpoint['pk'])
+        count = checkpoint['count']
+        opts['continuation'] = True
+    else:
+        stream = open(path, 'wb')
+        after = None
+        count = 0
+
+    state = {'count': count}
+
+    def iter_objects():
+        last = None
+        for chunk in iter_chunks(queryset, chunk_size, after):
+            if last is not None:
+                # Everything up to the end of the previous chunk has been
+                # written by the time the next object is requested.
+                stream.flush()
+                os.fsync(stream.fileno())
+                write_checkpoint(path, {
+                    'pk': pk_field.value_to_string(last),
+                    'offset': stream.tell(),
+                    'count': state['count']
+                })
+                if progress:
+                    progress(state['count'])
+            serializer._prefetch(chunk)
+            for obj in chunk:
+                yield obj
+            state['count'] += len(chunk)
+            last = chunk[-1]
+
+    try:
+        for data in serializer.encode_iter(iter_objects(), format, **opts):
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            stream.write(data)
+    finally:
+        stream.close()
+
+    if progress:
+        progress(state['count'])
+    if os.path.exists(get_checkpoint_path(path)):
+        os.remove(get_checkpoint_path(path))
+    return state['count']
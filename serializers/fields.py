@@ -1,15 +1,336 @@
+from decimal import Decimal
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections
+from django.db.models import Count, Sum
 from django.utils.encoding import is_protected_type, smart_unicode
+from django.db.models.query import prefetch_related_objects
 from django.db.models.related import RelatedObject
+from serializers.utils import LRUCache
+import datetime
+import types
+
+
+# The same types as `django.utils.encoding.is_protected_type`.
+_protected_types = (
+    types.NoneType,
+    int, long,
+    datetime.datetime, datetime.date, datetime.time,
+    float, Decimal
+)
+
+_registered_types = []
+_field_converters = {}
+_type_caches = [_field_converters]
+
+
+def register_type(cls, convert):
+    """
+    Register a function that should be used to serialize values of the given
+    type, or any of its subclasses.  Eg. `register_type(uuid.UUID, unicode)`.
+    """
+    _registered_types.insert(0, (cls, convert))
+    for cache in _type_caches:
+        cache.clear()
+
+
+def unregister_type(cls):
+    """
+    Remove any function registered for the given type.
+    """
+    _registered_types[:] = [(registered_cls, convert)
+                            for (registered_cls, convert) in _registered_types
+                            if registered_cls is not cls]
+    for cache in _type_caches:
+        cache.clear()
+
+
+def _get_registered_converter(cls):
+    for registered_cls, convert in _registered_types:
+        if issubclass(cls, registered_cls):
+            return convert
+    return None
+
+
+def _identity(obj):
+    return obj
+
+
+def _get_field_converter(cls):
+    """
+    Return the function that `Field.serialize` uses for values of the given
+    type, or `None` if the values should be iterated over.  The result is
+    cached, so this is only called the first time each type is seen.
+    """
+    convert = _get_registered_converter(cls)
+    if convert is None:
+        if issubclass(cls, _protected_types):
+            convert = _identity
+        elif hasattr(cls, '__iter__'):
+            convert = None
+        else:
+            convert = smart_unicode
+    _field_converters[cls] = convert
+    return convert
+
+
+def _prefetch_related(objs, field_name, single=False):
+    """
+    Load the related objects of a reverse foreign key or many to many
+    relationship for a list of model instances, with a single query.  If
+    `single` is set, then other relationships are loaded too.
+
+    Returns a list of all the related objects, or `None` if the field is not
+    a relationship that should be loaded.
+    """
+    if not objs:
+        return None
+    try:
+        field, model, direct, m2m = objs[0]._meta.get_field_by_name(field_name)
+    except Exception:
+        return None
+
+    if m2m or (not direct and not field.field.unique):
+        prefetch_related_objects(objs, [field_name])
+        related = []
+        for obj in objs:
+            items = getattr(obj, field_name).all()
+            if not direct and not m2m:
+                # Each object's foreign key back to the parent is known too.
+                cache_name = field.field.get_cache_name()
+                for item in items:
+                    setattr(item, cache_name, obj)
+            related.extend(items)
+        return related
+
+    elif single and (not direct or field.rel):
+        prefetch_related_objects(objs, [field_name])
+        related = []
+        for obj in objs:
+            try:
+                item = getattr(obj, field_name)
+            except ObjectDoesNotExist:
+                continue
+            if item is not None:
+                related.append(item)
+        return related
+    return None
+
+
+def _get_source_object(obj, source):
+    """
+    Given a dotted `source` such as 'owner.profile.email', follow all but the
+    last attribute from `obj`, returning the object that was reached, and the
+    name of the last attribute.  The object is `None` if any of the attributes
+    along the way are `None`, or are missing related objects.
+    """
+    names = source.split('.')
+    for name in names[:-1]:
+        try:
+            obj = getattr(obj, name)
+        except ObjectDoesNotExist:
+            return None, names[-1]
+        if obj is None:
+            break
+    return obj, names[-1]
+
+
+# The key that related objects loaded by `_prefetch_many_to_many` are kept
+# under in a serializer's memos, along with the model, field name, and
+# whether the objects or just their primary keys were loaded.
+_many_to_many_memo = '_serializer_many_to_many'
+
+
+def _prefetch_many_to_many(objs, field_name, memos, load_objects=True):
+    """
+    Load the related objects of a many to many field for a list of model
+    instances, with one ordered, streaming query on the through table, and
+    if `load_objects` is set, one further query for the distinct related
+    objects.  The related primary keys, or objects, are kept in `memos` for
+    `_get_prefetched_many_to_many`, until the end of the current encode.
+
+    Returns `False` if the field is not a many to many field.
+    """
+    if not objs:
+        return True
+    try:
+        field, model, direct, m2m = objs[0]._meta.get_field_by_name(field_name)
+    except Exception:
+        return False
+    if not (direct and m2m):
+        return False
+
+    through = field.rel.through
+    source_name = field.m2m_field_name()
+    target_name = field.m2m_reverse_field_name()
+    # Ordered as the related manager would order them, or else in the order
+    # that they were added.
+    ordering = []
+    for name in field.rel.to._meta.ordering:
+        if name.startswith('-'):
+            ordering.append('-%s__%s' % (target_name, name[1:]))
+        elif name != '?':
+            ordering.append('%s__%s' % (target_name, name))
+    rows = (through._default_manager.using(objs[0]._state.db)
+            .filter(**{source_name + '__in': [obj.pk for obj in objs]})
+            .order_by(source_name, *(ordering or ['pk']))
+            .values_list(source_name, target_name))
+
+    related = {}
+    for source, target in rows.iterator():
+        try:
+            related[source].append(target)
+        except KeyError:
+            related[source] = [target]
+
+    if load_objects:
+        targets = set()
+        for pks in related.values():
+            targets.update(pks)
+        if targets:
+            manager = field.rel.to._default_manager.using(objs[0]._state.db)
+            targets = manager.in_bulk(list(targets))
+        for source, pks in related.items():
+            related[source] = [targets[pk] for pk in pks if pk in targets]
+
+    key = (_many_to_many_memo, objs[0].__class__, field_name, load_objects)
+    cache = memos.setdefault(key, {})
+    for obj in objs:
+        cache[obj.pk] = related.get(obj.pk, [])
+    return True
+
+
+def _get_prefetched_many_to_many(obj, field_name, memos, load_objects=True):
+    """
+    Return the related primary keys, or objects, loaded for the given many
+    to many field of a model instance, or `None` if they weren't loaded.
+    """
+    key = (_many_to_many_memo, obj.__class__, field_name, load_objects)
+    cache = memos.get(key)
+    if cache is None:
+        return None
+    return cache.get(obj.pk)
+
+
+# The key that related objects loaded by `_prefetch_limited` are kept under
+# in a serializer's memos, along with the model and field name.
+_limited_memo = '_serializer_limited'
+
+# The number of per-parent queries combined into a single `UNION ALL` query.
+# SQLite allows at most 500 compound select terms by default.
+_limited_batch_size = 100
+
+
+def _get_ordering(model):
+    """
+    Return the ordering of a model's default queryset, with the primary key
+    added to break ties, so that limited results are deterministic.
+    """
+    return [name for name in model._meta.ordering if name != '?'] + ['pk']
+
+
+def _prefetch_limited(objs, field_name, max_items, memos, get_queryset=None):
+    """
+    Load up to `max_items` related objects of a reverse foreign key or many
+    to many relationship for each of a list of model instances.
+
+    Each instance's limited query is combined with the others' using
+    `UNION ALL`, so that only the primary keys of the related objects that
+    are needed are selected, with one query for each batch of instances,
+    and the objects themselves are then loaded with one further query.
+    `get_queryset` may be a function that is given the related model's
+    manager, and returns the queryset to load the objects with.  The objects
+    are kept in `memos` for `_get_prefetched_limited`, until the end of the
+    current encode.
+
+    Returns a list of all the related objects, or `None` if the field is not
+    a relationship that should be loaded.
+    """
+    if not objs:
+        return None
+    try:
+        field, model, direct, m2m = objs[0]._meta.get_field_by_name(field_name)
+    except Exception:
+        return None
+    if not (m2m or (not direct and not field.field.unique)):
+        return None
+
+    related_model = direct and field.rel.to or field.model
+    ordering = _get_ordering(related_model)
+    db = objs[0]._state.db
+    connection = connections[db]
+
+    pks = dict([(index, []) for index in range(len(objs))])
+    for start in range(0, len(objs), _limited_batch_size):
+        selects = []
+        params = []
+        for index in range(start, min(start + _limited_batch_size, len(objs))):
+            queryset = (getattr(objs[index], field_name).all()
+                        .order_by(*ordering)
+                        .extra(select={'_parent': '%s'}, select_params=(index,))
+                        .values_list('_parent', 'pk')[:max_items])
+            sql, select_params = queryset.query.get_compiler(db).as_sql()
+            selects.append('SELECT * FROM (%s) AS limited_%d' % (sql, index))
+            params.extend(select_params)
+        cursor = connection.cursor()
+        cursor.execute(' UNION ALL '.join(selects), params)
+        for index, pk in cursor.fetchall():
+            pks[int(index)].append(pk)
+
+    targets = set()
+    for values in pks.values():
+        targets.update(values)
+    manager = related_model._default_manager.db_manager(db)
+    if get_queryset is not None:
+        queryset = get_queryset(manager)
+    else:
+        queryset = manager.all()
+    positions = {}
+    loaded = {}
+    if targets:
+        queryset = queryset.filter(pk__in=list(targets)).order_by(*ordering)
+        for position, item in enumerate(queryset):
+            positions[item.pk] = position
+            loaded[item.pk] = item
+
+    related = []
+    cache = memos.setdefault((_limited_memo, objs[0].__class__, field_name), {})
+    for index, obj in enumerate(objs):
+        items = [loaded[pk] for pk in sorted(pks[index], key=positions.get)
+                 if pk in loaded]
+        if not direct and not m2m:
+            # Each object's foreign key back to the parent is known too.
+            cache_name = field.field.get_cache_name()
+            for item in items:
+                setattr(item, cache_name, obj)
+        cache[obj.pk] = items
+        related.extend(items)
+    return related
+
+
+def _get_prefetched_limited(obj, field_name, memos):
+    """
+    Return the related objects loaded for a relationship of a model instance
+    by `_prefetch_limited`, or `None` if they weren't loaded.
+    """
+    cache = memos.get((_limited_memo, obj.__class__, field_name))
+    if cache is None:
+        return None
+    return cache.get(obj.pk)
 
 
 class Field(object):
     creation_counter = 0
+    memo_hits = 0
+    memo_misses = 0
 
-    def __init__(self, source=None, label=None, serialize=None):
+    def __init__(self, source=None, label=None, serialize=None,
+                 memoize=None, memoize_size=None):
         self.source = source
         self.label = label
         if serialize:
             self.serialize = serialize
+        self.memoize = memoize
+        self.memoize_size = memoize_size
         self.creation_counter = Field.creation_counter
         Field.creation_counter += 1
 
@@ -17,14 +338,72 @@ class Field(object):
         """
         The entry point into a field, as called by it's parent serializer.
         """
+        if self.memoize is not None:
+            return self._serialize_memoized(obj, field_name, parent)
+
         self.obj = obj
+        self.memos = parent.memos
 
         if self.source == '*':
             return self.serialize(obj)
 
-        self.field_name = self.source or field_name
+        field_name = self.source or field_name
+        if '.' in field_name:
+            obj, field_name = _get_source_object(obj, field_name)
+            if obj is None:
+                return None
+            self.obj = obj
+        self.field_name = field_name
         return self.serialize_field(obj, self.field_name)
 
+    def _serialize_memoized(self, obj, field_name, parent):
+        """
+        Serialize the field, reusing the output for any earlier object with
+        the same `memoize(obj)` key.  Outputs are kept for the rest of the
+        encode, or if `memoize_size` is set, in a cache of that size that is
+        kept between encodes.
+        """
+        if self.memoize_size:
+            cache = self.__dict__.get('memo_cache')
+            if cache is None:
+                cache = self.memo_cache = LRUCache(self.memoize_size)
+        else:
+            cache = parent.memos
+        key = (self, self.memoize(obj))
+        try:
+            ret = cache[key]
+        except KeyError:
+            self.memo_misses += 1
+        else:
+            self.memo_hits += 1
+            return ret
+
+        memoize, self.memoize = self.memoize, None
+        try:
+            ret = self._serialize_field(obj, field_name, parent)
+        finally:
+            self.memoize = memoize
+        cache[key] = ret
+        return ret
+
+    def get_memo_hit_rate(self):
+        """
+        Return the proportion of lookups that were served from the memoized
+        outputs, or `None` if there haven't been any.
+        """
+        lookups = self.memo_hits + self.memo_misses
+        if not lookups:
+            return None
+        return self.memo_hits / float(lookups)
+
+    def prefetch_related(self, objs, field_name):
+        """
+        Called with a list of objects before they are serialized, so that any
+        related data that the field needs can be loaded for the whole list
+        at once, rather than once per object.
+        """
+        pass
+
     def serialize_field(self, obj, field_name):
         """
         Given the parent object and the field name, returns the field value
@@ -36,11 +415,13 @@ class Field(object):
         """
         Serializes the field's value into it's simple representation.
         """
-        if is_protected_type(obj):
-            return obj
-        elif hasattr(obj, '__iter__'):
+        try:
+            convert = _field_converters[obj.__class__]
+        except KeyError:
+            convert = _get_field_converter(obj.__class__)
+        if convert is None:
             return [self.serialize(item) for item in obj]
-        return smart_unicode(obj)
+        return convert(obj)
 
 
 class ModelField(Field):
@@ -67,14 +448,63 @@ class RelatedField(Field):
     A base class for model related fields or related managers.
     Subclass this and override `serialize` to define custom behaviour when
     serializing related objects.
+
+    Subclasses that need data from elsewhere may instead load it in batches,
+    by defining `collect(obj)`, which returns the key of the data that an
+    object needs, and `load_many(keys)`, which returns a dict of the data for
+    a list of keys.  `serialize` is then called with each object's data.
     """
+    collect = None
+    load_many = None
 
     def serialize_field(self, obj, field_name):
+        if self.load_many is not None:
+            return self.serialize(self.get_loaded(obj))
+        related = _get_prefetched_many_to_many(obj, field_name,
+                                               getattr(self, 'memos', {}))
+        if related is not None:
+            return [self.serialize(item) for item in related]
         obj = getattr(obj, field_name)
         if obj.__class__.__name__ in ('RelatedManager', 'ManyRelatedManager'):
             return [self.serialize(item) for item in obj.all()]
         return self.serialize(obj)
 
+    def prefetch_related(self, objs, field_name):
+        """
+        Reverse foreign keys and many to many relationships are loaded for the
+        whole list of objects with a single query.  Subclasses that need some
+        other related data may override this to load it in bulk, and keep it
+        for use in `serialize_field`.
+        """
+        field_name = self.source or field_name
+        if not _prefetch_many_to_many(objs, field_name, self.memos):
+            _prefetch_related(objs, field_name)
+
+    def load_batch(self, objs, parent):
+        """
+        Call `load_many` once for the keys of a list of objects, keeping the
+        results for `get_loaded` until the end of the parent's encode.
+        """
+        keys = set()
+        for obj in objs:
+            key = self.collect(obj)
+            if key is not None:
+                keys.add(key)
+        parent.memos[self] = keys and self.load_many(list(keys)) or {}
+
+    def get_loaded(self, obj):
+        """
+        Return the data loaded for an object, loading it on its own if it
+        was not part of a batch.
+        """
+        key = self.collect(obj)
+        if key is None:
+            return None
+        loaded = getattr(self, 'memos', {}).get(self)
+        if loaded is None or key not in loaded:
+            loaded = self.load_many([key])
+        return loaded.get(key)
+
     def attributes(self):
         field = self.obj._meta.get_field_by_name(self.field_name)[0]
         return {
@@ -98,6 +528,11 @@ class PrimaryKeyRelatedField(RelatedField):
     #         return obj.pk
 
     def serialize_field(self, obj, field_name):
+        related = _get_prefetched_many_to_many(obj, field_name,
+                                               getattr(self, 'memos', {}),
+                                               load_objects=False)
+        if related is not None:
+            return related
         self.test = field_name
         try:
             obj = obj.serializable_value(field_name)
@@ -113,9 +548,21 @@ class PrimaryKeyRelatedField(RelatedField):
             return [item.pk for item in obj.all()]
         return obj
 
+    def prefetch_related(self, objs, field_name):
+        """
+        Only the primary keys of many to many relationships are needed, so
+        they are loaded from the through table, without the related objects.
+        """
+        field_name = self.source or field_name
+        if not _prefetch_many_to_many(objs, field_name, self.memos,
+                                      load_objects=False):
+            _prefetch_related(objs, field_name)
+
 
 class NaturalKeyRelatedField(RelatedField):
     def serialize(self, obj):
+        if obj is None:
+            return None
         return obj.natural_key()
 
 
@@ -125,3 +572,64 @@ class ModelNameField(Field):
     """
     def serialize_field(self, obj, field_name):
         return smart_unicode(obj._meta)
+
+
+class AggregateField(Field):
+    """
+    Serializes an aggregate over a model instance's related objects, such as
+    the number of objects in a reverse relationship.
+
+    The aggregate is loaded in bulk, with one grouped query per chunk that
+    is separate from the objects' own query, so that its joins and rows are
+    left alone.  Values are kept until the end of the current encode.
+    """
+    aggregate = None
+
+    def __init__(self, lookup, *args, **kwargs):
+        self.lookup = lookup
+        self.distinct = kwargs.pop('distinct', False)
+        super(AggregateField, self).__init__(*args, **kwargs)
+
+    def get_aggregate(self):
+        if self.distinct:
+            return self.aggregate(self.lookup, distinct=True)
+        return self.aggregate(self.lookup)
+
+    def prefetch_related(self, objs, field_name):
+        if not objs:
+            return
+        model = objs[0].__class__
+        rows = (model._default_manager.db_manager(objs[0]._state.db)
+                .filter(pk__in=[obj.pk for obj in objs])
+                .order_by()
+                .values('pk')
+                .annotate(value=self.get_aggregate()))
+        values = dict([(row['pk'], row['value']) for row in rows])
+        cache = self.memos.setdefault((self, model), {})
+        for obj in objs:
+            cache[obj.pk] = values.get(obj.pk)
+
+    def serialize_field(self, obj, field_name):
+        cache = self.memos.get((self, obj.__class__))
+        if cache is None or obj.pk not in cache:
+            self.prefetch_related([obj], field_name)
+            cache = self.memos[(self, obj.__class__)]
+        return self.serialize(cache[obj.pk])
+
+
+class CountField(AggregateField):
+    """
+    Serializes the number of related objects.  Eg. `CountField('vehicles')`.
+    """
+    aggregate = Count
+
+    def serialize(self, obj):
+        return obj or 0
+
+
+class SumField(AggregateField):
+    """
+    Serializes the sum of a field over the related objects.
+    Eg. `SumField('vehicles__mileage')`.
+    """
+    aggregate = Sum
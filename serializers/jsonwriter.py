@@ -0,0 +1,139 @@
+"""
+Helpers for writing json text directly, rather than building native python
+structures and then rendering them with `json.dumps`.
+
+The output is identical to `JSONRenderer`'s for the same `indent` and
+`sort_keys` options.
+"""
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+import datetime
+import types
+
+
+def _encode_none(encoder, value):
+    return 'null'
+
+
+def _encode_bool(encoder, value):
+    return value and 'true' or 'false'
+
+
+def _encode_int(encoder, value):
+    return str(value)
+
+
+def _encode_string(encoder, value):
+    return encoder.encode(value)
+
+
+def _encode_datetime(encoder, value):
+    return encoder.encode(encoder.default(value))
+
+
+# Fast encoders for the most common scalar types, keyed on the exact type.
+_scalar_encoders = {
+    types.NoneType: _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    long: _encode_int,
+    str: _encode_string,
+    unicode: _encode_string,
+    datetime.datetime: _encode_datetime,
+    datetime.date: _encode_datetime,
+    datetime.time: _encode_datetime,
+}
+
+
+class JSONWriter(object):
+    """
+    Encodes values and pre-builds the fragments of json objects, such as
+    `, "name": `, for serializers that write json directly.
+    """
+    def __init__(self, indent=None, sort_keys=False):
+        self.encoder = DateTimeAwareJSONEncoder(indent=indent, sort_keys=sort_keys)
+        self.indent = indent
+        self.sort_keys = sort_keys
+        self._layouts = {}
+
+    def newline(self, level):
+        """
+        Return the line break and indentation for the given nesting level.
+        """
+        if self.indent is None:
+            return ''
+        return '\n' + ' ' * (self.indent * level)
+
+    def encode(self, value, level):
+        """
+        Encode a native python value, nested at the given level.
+        """
+        try:
+            encode = _scalar_encoders[value.__class__]
+        except KeyError:
+            text = self.encoder.encode(value)
+            if self.indent is not None and level:
+                text = text.replace('\n', self.newline(level))
+            return text
+        return encode(self.encoder, value)
+
+    def list_fragments(self, level):
+        """
+        Return the `(start, separator, end)` fragments for a non-empty list
+        nested at the given level.
+        """
+        newline = self.newline(level + 1)
+        return ('[' + newline,
+                self.encoder.item_separator + newline,
+                self.newline(level) + ']')
+
+    def get_layout(self, plan, level, ordered):
+        """
+        Given a field plan, return a tuple of `(fragments, end)`, where
+        `fragments` is a list of `(index, fragment)` pairs, giving the plan
+        index of each value, in the order they are written, and the fragment
+        that precedes it.  `ordered` should be `True` if the serializer
+        outputs a `SortedDict`.
+
+        Returns `None` if the plan's keys are not all strings.
+        """
+        layout_key = (id(plan), level)
+        try:
+            return self._layouts[layout_key]
+        except KeyError:
+            pass
+
+        keys = [key for (field_name, key, field) in plan]
+        if not all(isinstance(key, basestring) for key in keys):
+            self._layouts[layout_key] = None
+            return None
+
+        # The last value for a repeated key wins, as it would in a dict.
+        indexes = {}
+        for index, key in enumerate(keys):
+            indexes[key] = index
+
+        if self.sort_keys:
+            order = sorted(indexes)
+        elif ordered:
+            order = [key for (index, key) in enumerate(keys)
+                     if keys.index(key) == index]
+        else:
+            # Use the same key order that a dict built from the plan has.
+            sample = {}
+            for key in keys:
+                sample[key] = None
+            order = list(sample)
+
+        if not order:
+            layout = ([], '{}')
+        else:
+            newline = self.newline(level + 1)
+            separator = self.encoder.item_separator + newline
+            fragments = []
+            for position, key in enumerate(order):
+                prefix = position and separator or '{' + newline
+                fragment = prefix + self.encoder.encode(key) + self.encoder.key_separator
+                fragments.append((indexes[key], fragment))
+            layout = (fragments, self.newline(level) + '}')
+        self._layouts[layout_key] = layout
+        return layout
@@ -0,0 +1,292 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, DEFAULT_DB_ALIAS
+from django.db.models import get_app, get_apps, get_model, get_models
+from optparse import make_option
+from serializers import DumpDataSerializer
+from serializers.exports import export
+from serializers.renderers import _get_list_separators
+import multiprocessing
+import os
+import shutil
+import time
+
+
+# Set in each worker process, to report progress back to the command.
+_progress = None
+
+
+def _init_worker(progress):
+    global _progress
+    _progress = progress
+
+
+def dump_model(task):
+    """
+    Dump all the instances of a model to a file, returning the label of the
+    model and the number of objects dumped.
+    """
+    label, path, format, chunk_size, using, resume, opts = task
+    model = get_model(*label.split('.'))
+    queryset = model._default_manager.using(using)
+
+    def progress(count):
+        _progress.put((label, count))
+
+    count = export(DumpDataSerializer(), queryset, path, format, chunk_size,
+                   resume=resume, progress=progress, **opts)
+    return label, count
+
+
+class _Progress(object):
+    """
+    Reports progress directly, when dumping in the command's own process.
+    """
+    def __init__(self, command):
+        self.command = command
+
+    def put(self, message):
+        self.command.report(*message)
+
+
+def _get_models(labels, using=DEFAULT_DB_ALIAS):
+    """
+    Given a list of 'app_label' or 'app_label.ModelName' labels, return the
+    list of models they refer to that should be dumped from the database.
+    Defaults to every installed model.
+
+    As with `dumpdata`, proxy models are skipped, as their rows are dumped
+    with their concrete models, along with unmanaged models and any models
+    that the database routers don't sync to the database.
+    """
+    return [model for model in _get_labelled_models(labels)
+            if not model._meta.proxy and model._meta.managed and
+            router.allow_syncdb(using, model)]
+
+
+def _get_labelled_models(labels):
+    if not labels:
+        return [model for app in get_apps() for model in get_models(app)]
+    models = []
+    for label in labels:
+        if '.' in label:
+            model = get_model(*label.split('.', 1))
+            if model is None:
+                raise CommandError("Unknown model: %s" % label)
+            models.append(model)
+        else:
+            try:
+                models.extend(get_models(get_app(label)))
+            except Exception:
+                raise CommandError("Unknown application: %s" % label)
+    return models
+
+
+def sort_models(models):
+    """
+    Sort models so that each model comes after any of the other models that
+    it refers to, by relationships or natural key dependencies, so that
+    fixtures can be loaded in order.  Cycles are left in their given order.
+    """
+    remaining = list(models)
+    dependencies = {}
+    for model in remaining:
+        deps = set()
+        for field in model._meta.fields + model._meta.many_to_many:
+            if field.rel and field.rel.to is not model:
+                deps.add(field.rel.to)
+        if hasattr(model, 'natural_key'):
+            for dep in getattr(model.natural_key, 'dependencies', []):
+                deps.add(get_model(*dep.split('.')))
+        dependencies[model] = deps & set(remaining)
+
+    ret = []
+    while remaining:
+        ready = [model for model in remaining
+                 if not dependencies[model] - set(ret)]
+        if not ready:
+            ready = remaining[:1]
+        for model in ready:
+            ret.append(model)
+            remaining.remove(model)
+    return ret
+
+
+def _read_range(stream, start, end, block_size=64 * 1024):
+    stream.seek(start)
+    while start < end:
+        data = stream.read(min(block_size, end - start))
+        if not data:
+            return
+        start += len(data)
+        yield data
+
+
+def _get_json_items_range(stream, size):
+    """
+    Return the offsets of the items in a file containing a json list, without
+    the enclosing brackets and whitespace, or `None` if the list is empty.
+    """
+    head = stream.read(4096)
+    start = head.index('[') + 1
+    start += len(head[start:]) - len(head[start:].lstrip())
+    tail_start = max(0, size - 4096)
+    stream.seek(tail_start)
+    tail = stream.read()
+    end = tail_start + len(tail[:tail.rindex(']')].rstrip())
+    if end <= start:
+        return None
+    return start, end
+
+
+def merge_files(paths, output, format, indent=None):
+    """
+    Merge the list of objects in each file into a single list, streaming
+    the files into the output, without loading them into memory.
+    """
+    if format == 'json':
+        newline, separator = _get_list_separators(indent)
+        output.write('[')
+        empty = True
+        for path in paths:
+            with open(path, 'rb') as stream:
+                items = _get_json_items_range(stream, os.path.getsize(path))
+                if items is None:
+                    continue
+                output.write(newline if empty else separator)
+                empty = False
+                for data in _read_range(stream, *items):
+                    output.write(data)
+        if newline and not empty:
+            output.write('\n')
+        output.write(']')
+
+    elif format == 'yaml':
+        # Block style yaml lists can simply be concatenated.
+        empty = True
+        for path in paths:
+            with open(path, 'rb') as stream:
+                if stream.read(2) == '[]':
+                    continue
+                stream.seek(0)
+                shutil.copyfileobj(stream, output)
+                empty = False
+        if empty:
+            output.write('[]\n')
+
+    else:
+        raise CommandError("Merging is not supported for the '%s' format" % format)
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--format', default='json', dest='format',
+            help='Specifies the output serialization format for fixtures.'),
+        make_option('--indent', default=None, dest='indent', type='int',
+            help='Specifies the indent level to use when pretty-printing output'),
+        make_option('--database', action='store', dest='database',
+            default=DEFAULT_DB_ALIAS, help='Nominates a specific database to dump '
+                'fixtures from. Defaults to the "default" database.'),
+        make_option('-n', '--natural', action='store_true', dest='use_natural_keys', default=False,
+            help='Use natural keys if they are available.'),
+        make_option('--workers', dest='workers', type='int', default=None,
+            help='The number of worker processes to dump with. Defaults to the '
+                 'number of CPUs. Use 1 to dump in the current process.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+            help='The number of objects to fetch from the database at a time, '
+                 'and to write between checkpoints.'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+            help='Resume interrupted dumps from their last checkpoint, rather '
+                 'than starting them again.'),
+        make_option('--output-dir', dest='output_dir', default='.',
+            help='The directory to write a fixture file per model to.'),
+        make_option('--merge', dest='merge', default=None,
+            help='Also merge the fixture files into a single fixture at this path, '
+                 'with the models in dependency order.'),
+    )
+    help = ("Dump the contents of the database to a fixture file per model, "
+            "dumping several models at once in worker processes.")
+    args = '[appname appname.ModelName ...]'
+
+    def handle(self, *labels, **options):
+        format = options.get('format')
+        indent = options.get('indent')
+        using = options.get('database')
+        workers = options.get('workers') or multiprocessing.cpu_count()
+        chunk_size = options.get('chunk_size')
+        output_dir = options.get('output_dir')
+        merge = options.get('merge')
+        resume = options.get('resume')
+        self.verbosity = int(options.get('verbosity', 1))
+
+        if format not in DumpDataSerializer.renderer_classes:
+            raise CommandError("Unknown serialization format: %s" % format)
+        if merge and format not in ('json', 'yaml'):
+            raise CommandError("Merging is not supported for the '%s' format" % format)
+
+        models = sort_models(_get_models(labels, using))
+        opts = {'use_natural_keys': options.get('use_natural_keys')}
+        if indent is not None:
+            opts['indent'] = indent
+        tasks = []
+        for model in models:
+            label = '%s.%s' % (model._meta.app_label, model._meta.object_name)
+            path = os.path.join(output_dir, '%s.%s' % (label, format))
+            tasks.append((label, path, format, chunk_size, using, resume, opts))
+
+        self.started = time.time()
+        self.done = 0
+        self.total = len(tasks)
+        if workers == 1:
+            global _progress
+            _progress = _Progress(self)
+            for task in tasks:
+                self.finished(*dump_model(task))
+        else:
+            self.dump_parallel(tasks, workers)
+
+        if merge:
+            with open(merge, 'wb') as output:
+                merge_files([task[1] for task in tasks], output, format, indent)
+            if self.verbosity >= 1:
+                self.stderr.write("Merged %d models into %s\n" % (len(tasks), merge))
+
+    def dump_parallel(self, tasks, workers):
+        # Connections can't be shared with the worker processes, so they are
+        # closed before forking, and each worker opens its own.  Closing them
+        # in the workers instead would end the parent's session, as the
+        # socket is shared.
+        for connection in connections.all():
+            connection.close()
+        progress = multiprocessing.Queue()
+        pool = multiprocessing.Pool(workers, _init_worker, (progress,))
+        try:
+            results = pool.imap_unordered(dump_model, tasks)
+            while self.done < self.total:
+                try:
+                    label, count = results.next(0.5)
+                except multiprocessing.TimeoutError:
+                    self.drain(progress)
+                    continue
+                self.drain(progress)
+                self.finished(label, count)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def drain(self, progress):
+        while not progress.empty():
+            self.report(*progress.get())
+
+    def report(self, label, count):
+        if self.verbosity >= 2:
+            self.stderr.write("%s: %d objects\n" % (label, count))
+
+    def finished(self, label, count):
+        self.done += 1
+        if self.verbosity >= 1:
+            self.stderr.write("[%d/%d] Dumped %d %s objects (%.1fs)\n" %
+                              (self.done, self.total, count, label,
+                               time.time() - self.started))
@@ -0,0 +1,186 @@
+"""
+Runtime metrics for serialization, such as how long encoding takes, and how
+many objects, bytes and queries it involves.
+
+Metrics are reported to a backend, which is set with `set_backend()`.  The
+default backend is `NullMetrics`, which is disabled, so that serializers skip
+measuring anything at all.  `AggregatingMetrics` keeps the measurements in
+process and summarizes them, and other backends, eg. for statsd, may be
+written by implementing `record()`.
+"""
+from serializers.queries import QueryTracker
+from timeit import default_timer as timer
+import math
+import random
+import threading
+
+
+class NullMetrics(object):
+    """
+    Discards all metrics.  Serializers check `enabled` before measuring
+    anything, so this backend adds no overhead.
+    """
+    enabled = False
+
+    def record(self, name, tags, duration, objects=None, bytes=None,
+               queries=None):
+        """
+        Record a single measurement, of an 'encode', 'serialize' or 'render'
+        step.  `tags` is a dict including the 'serializer' class name and
+        the 'format'.  Values that aren't known are passed as `None`.
+        """
+        pass
+
+
+def _percentile(values, percent):
+    """
+    Return the nearest-rank percentile of a sorted list of values.
+    """
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+
+class AggregatingMetrics(NullMetrics):
+    """
+    Keeps metrics in memory, grouped by name and tags, and reports
+    percentile summaries of them.
+
+    At most `max_samples` measurements are kept for each group, chosen by
+    reservoir sampling, so that memory use is bounded in long running
+    processes.
+    """
+    enabled = True
+    values = ('duration', 'objects', 'bytes', 'queries')
+
+    def __init__(self, max_samples=10000, percentiles=(50, 90, 99)):
+        self.max_samples = max_samples
+        self.percentiles = percentiles
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.groups = {}
+
+    def record(self, name, tags, duration, objects=None, bytes=None,
+               queries=None):
+        key = (name, tuple(sorted(tags.items())))
+        sample = (duration, objects, bytes, queries)
+        with self.lock:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = [0, []]
+            group[0] += 1
+            samples = group[1]
+            if len(samples) < self.max_samples:
+                samples.append(sample)
+            else:
+                index = random.randint(0, group[0] - 1)
+                if index < self.max_samples:
+                    samples[index] = sample
+
+    def summarize(self, values):
+        values = sorted(values)
+        ret = {
+            'min': values[0],
+            'max': values[-1],
+            'mean': sum(values) / float(len(values)),
+        }
+        for percent in self.percentiles:
+            ret['p%s' % percent] = _percentile(values, percent)
+        return ret
+
+    def summary(self):
+        """
+        Return a list of dicts, one for each name and set of tags, with the
+        `count` of measurements, and summaries of each value that was
+        measured, with the `min`, `max`, `mean` and percentiles such as `p99`.
+        """
+        with self.lock:
+            groups = [(key, count, list(samples))
+                      for (key, (count, samples)) in self.groups.items()]
+        ret = []
+        for (name, tags), count, samples in sorted(groups):
+            item = {'name': name, 'tags': dict(tags), 'count': count}
+            for index, value_name in enumerate(self.values):
+                values = [sample[index] for sample in samples
+                          if sample[index] is not None]
+                if values:
+                    item[value_name] = self.summarize(values)
+            ret.append(item)
+        return ret
+
+
+backend = NullMetrics()
+
+
+def get_backend():
+    return backend
+
+
+def set_backend(new_backend):
+    """
+    Set the backend that metrics are reported to, or `None` to disable them.
+    Returns the previous backend.
+    """
+    global backend
+    previous = backend
+    backend = new_backend or NullMetrics()
+    return previous
+
+
+def count_objects(data):
+    """
+    Return the number of objects in serialized data.
+    """
+    if isinstance(data, (list, tuple)):
+        return len(data)
+    return 1
+
+
+class CountingIterator(object):
+    """
+    Wraps an iterator over serialized objects, counting them as they are
+    consumed.
+    """
+    def __init__(self, items):
+        self.items = iter(items)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        item = self.items.next()
+        self.count += 1
+        return item
+
+
+def measure_iter(chunks, tags, objects=None, start=None, tracker=None):
+    """
+    Yield the chunks of an `encode_iter` output, recording an 'encode'
+    measurement once they have all been consumed.  `objects` is the number
+    of serialized objects, or a `CountingIterator` that counts them.  The
+    `start` time and query `tracker` may be given, if some of the work was
+    done before the chunks were consumed.
+
+    Queries are only counted while each chunk is being produced, so that
+    any made by the consumer in between are not included.
+    """
+    if start is None:
+        start = timer()
+    if tracker is None:
+        tracker = QueryTracker()
+    size = 0
+    chunks = iter(chunks)
+    while True:
+        with tracker:
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                break
+        size += len(chunk)
+        yield chunk
+    if isinstance(objects, CountingIterator):
+        objects = objects.count
+    backend.record('encode', tags, timer() - start, objects=objects,
+                   bytes=size, queries=tracker.count)
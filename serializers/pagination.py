@@ -0,0 +1,86 @@
+"""
+Keyset pagination, for serializing large querysets one page at a time.
+
+Rather than using an offset, each page is fetched by filtering on the
+ordering of the last object of the previous page, so that the cost of
+fetching a page does not grow the further through the results it is.
+"""
+from django.core import signing
+from django.db.models import Q
+import operator
+
+
+_salt = 'serializers.pagination'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_keyset_ordering(queryset, ordering=None):
+    """
+    Return the ordering to paginate by, as a tuple of field names, with
+    the primary key added at the end if needed, so that it is unique.
+    """
+    if not ordering:
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+    ordering = tuple(ordering)
+    names = [name.lstrip('-') for name in ordering]
+    pk_name = queryset.model._meta.pk.name
+    if 'pk' not in names and pk_name not in names:
+        ordering += ('pk',)
+    return ordering
+
+
+def _get_field(model, name):
+    name = name.lstrip('-')
+    if name == 'pk':
+        return model._meta.pk
+    field = model._meta.get_field_by_name(name)[0]
+    if not getattr(field, 'column', None) or field.rel:
+        raise ValueError("Can only paginate by concrete, non-related fields, "
+                         "not '%s'" % name)
+    return field
+
+
+def encode_cursor(model, ordering, obj):
+    """
+    Return an opaque token that identifies the position after `obj`.
+    """
+    values = [_get_field(model, name).value_to_string(obj)
+              for name in ordering]
+    return signing.dumps([list(ordering), values], salt=_salt)
+
+
+def decode_cursor(model, ordering, cursor):
+    """
+    Return the ordering values that a token returned by `encode_cursor`
+    identifies.
+    """
+    try:
+        token_ordering, values = signing.loads(cursor, salt=_salt)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if tuple(token_ordering) != tuple(ordering) or len(values) != len(ordering):
+        raise InvalidCursor("Cursor does not match the ordering")
+    return [_get_field(model, name).to_python(value)
+            for name, value in zip(ordering, values)]
+
+
+def keyset_filter(ordering, values):
+    """
+    Return a `Q` object matching the rows that come after the given values
+    of the ordering fields.  Eg. for the ordering ('a', 'b'), the rows where
+    `a > x OR (a = x AND b > y)`.
+    """
+    clauses = []
+    for index, name in enumerate(ordering):
+        lookups = {}
+        for previous, value in zip(ordering[:index], values):
+            lookups[previous.lstrip('-')] = value
+        if name.startswith('-'):
+            lookups[name[1:] + '__lt'] = values[index]
+        else:
+            lookups[name + '__gt'] = values[index]
+        clauses.append(Q(**lookups))
+    return reduce(operator.or_, clauses)
@@ -0,0 +1,61 @@
+"""
+Rendering large lists of already serialized data using several processes.
+
+The list is split into chunks, and each chunk is rendered in a worker process,
+using the renderer's `continuation` and `partial` options, so that the chunks
+can simply be joined into the same document the renderer would give for the
+whole list.
+"""
+import multiprocessing
+
+
+# Set in each worker process.  On platforms with `fork()`, the data is
+# inherited by the workers, rather than being pickled.
+_render_task = None
+
+
+def _init_worker(renderer_class, data, opts):
+    global _render_task
+    _render_task = (renderer_class, data, opts)
+
+
+def _render_chunk(chunk):
+    start, end = chunk
+    renderer_class, data, opts = _render_task
+    opts = dict(opts, continuation=start > 0, partial=end < len(data))
+    return ''.join(renderer_class().render_iter(data[start:end], **opts))
+
+
+def can_render_parallel(data, **opts):
+    """
+    True if the data may be rendered in chunks.  Lists are required to be
+    lists of dicts, since lists of plain values may be rendered differently
+    depending on their contents, eg. in flow style by the yaml renderer.
+    """
+    return (isinstance(data, (list, tuple)) and
+            not opts.get('default_flow_style') and
+            all([isinstance(item, dict) for item in data[:1]]))
+
+
+def render_parallel(renderer_class, data, workers=None, chunk_size=1000,
+                    **opts):
+    """
+    Render a list using a pool of `workers` processes, defaulting to the
+    number of CPUs, giving the same output as rendering it in one go.
+    """
+    if not can_render_parallel(data, **opts) or len(data) <= chunk_size:
+        return renderer_class().render(data, **opts)
+
+    chunks = [(start, min(start + chunk_size, len(data)))
+              for start in range(0, len(data), chunk_size)]
+    pool = multiprocessing.Pool(workers, _init_worker,
+                                (renderer_class, data, opts))
+    try:
+        ret = ''.join(pool.imap(_render_chunk, chunks))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return ret
@@ -0,0 +1,139 @@
+"""
+Counting the database queries that serialization issues, so that serializers
+which query once per object can be caught early.
+
+Queries are attributed to the field that caused them, such as 'vehicles' or
+'vehicles.owner', by looking up the call stack when the query is executed,
+so that there's no overhead in the serialization code itself.
+"""
+from django.db import connections, DEFAULT_DB_ALIAS
+from serializers.fields import Field
+import logging
+import re
+import sys
+
+
+logger = logging.getLogger('serializers')
+
+_placeholders = re.compile(r'(%s, )+%s')
+
+# The methods that fields are called through, with a `field_name` argument.
+_field_methods = frozenset(['_serialize_field', 'prefetch_related'])
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def _get_field_path():
+    """
+    Return the dotted path of the fields currently being serialized, by
+    looking for calls to field methods in the call stack.
+    """
+    names = []
+    last = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name in _field_methods:
+            field = frame.f_locals.get('self')
+            field_name = frame.f_locals.get('field_name')
+            if (isinstance(field, Field) and field is not last and
+                isinstance(field_name, basestring)):
+                names.append(field_name)
+                last = field
+        frame = frame.f_back
+    names.reverse()
+    return '.'.join(names)
+
+
+class _TrackedCursor(object):
+    def __init__(self, cursor, tracker):
+        self.cursor = cursor
+        self.tracker = tracker
+
+    def execute(self, sql, params=()):
+        self.tracker.record(sql)
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.tracker.record(sql)
+        return self.cursor.executemany(sql, param_list)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class QueryTracker(object):
+    """
+    A context manager that counts the queries made on a database connection,
+    grouped by field path and by similar sql.
+
+    If `max_queries` is exceeded then `QueryBudgetExceeded` is raised, or if
+    `action` is 'log', a warning is logged once instead.
+    """
+    def __init__(self, max_queries=None, action='raise', using=DEFAULT_DB_ALIAS):
+        if action not in ('raise', 'log'):
+            raise ValueError("Unknown query budget action '%s'" % action)
+        self.max_queries = max_queries
+        self.action = action
+        self.using = using
+        self.count = 0
+        self.paths = {}
+        self.similar = {}
+        self.logged = False
+
+    def __enter__(self):
+        connection = connections[self.using]
+        cursor = connection.cursor
+        # Trackers may be nested, so restore any outer tracker's cursor.
+        self.previous = connection.__dict__.get('cursor')
+        connection.cursor = lambda: _TrackedCursor(cursor(), self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection = connections[self.using]
+        if self.previous is None:
+            del connection.cursor
+        else:
+            connection.cursor = self.previous
+
+    def record(self, sql):
+        path = _get_field_path()
+        self.count += 1
+        self.paths[path] = self.paths.get(path, 0) + 1
+        key = (path, _placeholders.sub('%s', sql))
+        self.similar[key] = self.similar.get(key, 0) + 1
+
+        if self.max_queries is not None and self.count > self.max_queries:
+            message = self.get_message()
+            if self.action == 'raise':
+                raise QueryBudgetExceeded(message)
+            elif not self.logged:
+                logger.warning(message)
+                self.logged = True
+
+    def repeated(self):
+        """
+        Return a list of `(path, sql, count)` for the queries that were made
+        more than once, most frequent first.
+        """
+        ret = [(path, sql, count)
+               for ((path, sql), count) in self.similar.items()
+               if count > 1]
+        ret.sort(key=lambda item: (-item[2], item[0]))
+        return ret
+
+    def get_message(self):
+        message = "Serialization made %d queries" % self.count
+        if self.max_queries is not None:
+            message += ", exceeding the budget of %d" % self.max_queries
+        repeated = self.repeated()
+        if repeated:
+            message += ".  Repeated queries:\n" + '\n'.join([
+                "  %s (x%d): %s" % (path or '<root>', count, sql)
+                for (path, sql, count) in repeated
+            ])
+        return message
@@ -2,23 +2,132 @@ import datetime
 from django.core.serializers.json import DateTimeAwareJSONEncoder
 from django.utils import simplejson as json
 from django.utils.encoding import smart_unicode
+from django.utils.datastructures import SortedDict
 from django.utils.xmlutils import SimplerXMLGenerator
-from serializers.utils import SafeDumper, DictWriter
+from xml.sax.saxutils import escape, quoteattr
+from serializers.utils import (
+    DictWithMetadata,
+    SortedDictWithMetadata,
+    DictWriter
+)
 import StringIO
+
+
 try:
     import yaml
 except ImportError:
     yaml = None
+    SafeDumper = None
+else:
+    # Adapted from http://pyyaml.org/attachment/ticket/161/use_ordered_dict.py
+    class SafeDumper(yaml.SafeDumper):
+        """
+        Handles decimals as strings.
+        Handles SortedDicts as usual dicts, but preserves field order, rather
+        than the usual behaviour of sorting the keys.
+        """
+        def represent_decimal(self, data):
+            return self.represent_scalar('tag:yaml.org,2002:str', str(data))
+
+        def represent_mapping(self, tag, mapping, flow_style=None):
+            value = []
+            node = yaml.MappingNode(tag, value, flow_style=flow_style)
+            if self.alias_key is not None:
+                self.represented_objects[self.alias_key] = node
+            best_style = True
+            if hasattr(mapping, 'items'):
+                mapping = list(mapping.items())
+                if not isinstance(mapping, SortedDict):
+                    mapping.sort()
+            for item_key, item_value in mapping:
+                node_key = self.represent_data(item_key)
+                node_value = self.represent_data(item_value)
+                if not (isinstance(node_key, yaml.ScalarNode) and not node_key.style):
+                    best_style = False
+                if not (isinstance(node_value, yaml.ScalarNode) and not node_value.style):
+                    best_style = False
+                value.append((node_key, node_value))
+            if flow_style is None:
+                if self.default_flow_style is not None:
+                    node.flow_style = self.default_flow_style
+                else:
+                    node.flow_style = best_style
+            return node
+
+    SafeDumper.add_representer(SortedDict,
+            yaml.representer.SafeRepresenter.represent_dict)
+    SafeDumper.add_representer(DictWithMetadata,
+            yaml.representer.SafeRepresenter.represent_dict)
+    SafeDumper.add_representer(SortedDictWithMetadata,
+            yaml.representer.SafeRepresenter.represent_dict)
+
+
+def _is_list(obj):
+    """
+    True if the object should be rendered as a list.  Includes iterators,
+    so that the serialized items may be generated lazily while streaming.
+    """
+    return hasattr(obj, '__iter__') and not isinstance(obj, dict)
+
+
+def _natural_key_to_xml(value):
+    return u''.join([u'<natural>%s</natural>' % escape(smart_unicode(item))
+                     for item in value])
+
+
+def _get_list_separators(indent=None, encoder=None):
+    """
+    Return the `(newline, separator)` that a top level json list is rendered
+    with, where `newline` comes before the first item, and `separator`
+    between each of the items.
+    """
+    if encoder is None:
+        encoder = DateTimeAwareJSONEncoder(indent=indent)
+    if indent is None:
+        newline = ''
+    else:
+        newline = '\n' + ' ' * indent
+    return newline, encoder.item_separator + newline
+
+
+def _drain(stream):
+    """
+    Return the contents of a `StringIO` stream, and empty it.
+    """
+    ret = stream.getvalue()
+    stream.seek(0)
+    stream.truncate()
+    return ret
 
 
 class BaseRenderer(object):
     """
     Defines the base interface that renderers should implement.
     """
+    # Whether the renderer can render the output of `serialize_columns`.
+    columnar = True
 
     def render(obj, **opts):
         return str(obj)
 
+    def render_iter(self, obj, **opts):
+        """
+        Render a native python object, returning an iterator over chunks
+        of the output.  If `obj` is a list or an iterator, then renderers
+        that support streaming will render each item as it is consumed.
+
+        Streaming renderers also accept a `continuation` option, for
+        appending the remaining items to the output of a list that was
+        interrupted after rendering at least one item.  The start of the
+        document is then left out, so that the combined output is the same
+        as if the whole list had been rendered in one go.  Similarly, the
+        `partial` option leaves out the end of the document, so that further
+        items may be appended with `continuation`.
+        """
+        if _is_list(obj) and not isinstance(obj, (list, tuple)):
+            obj = list(obj)
+        yield self.render(obj, **opts)
+
 
 class JSONRenderer(BaseRenderer):
     """
@@ -31,6 +140,38 @@ class JSONRenderer(BaseRenderer):
         return json.dumps(obj, cls=DateTimeAwareJSONEncoder,
                           indent=indent, sort_keys=sort_keys)
 
+    def render_iter(self, obj, **opts):
+        indent = opts.pop('indent', None)
+        sort_keys = opts.pop('sort_keys', False)
+        continuation = opts.pop('continuation', False)
+        partial = opts.pop('partial', False)
+        encoder = DateTimeAwareJSONEncoder(indent=indent, sort_keys=sort_keys)
+
+        if not _is_list(obj):
+            for chunk in encoder.iterencode(obj):
+                yield chunk
+            return
+
+        # Each list item is encoded separately, so we need to add the
+        # list's own separators and indentation, as `json.dumps` would.
+        newline, separator = _get_list_separators(indent, encoder)
+
+        if not continuation:
+            yield '['
+        empty = not continuation
+        for item in obj:
+            yield newline if empty else separator
+            empty = False
+            for chunk in encoder.iterencode(item):
+                if newline:
+                    chunk = chunk.replace('\n', newline)
+                yield chunk
+        if partial:
+            return
+        if newline and not empty:
+            yield '\n'
+        yield ']'
+
 
 class YAMLRenderer(BaseRenderer):
     """
@@ -42,6 +183,38 @@ class YAMLRenderer(BaseRenderer):
         return yaml.dump(obj, Dumper=SafeDumper,
                          indent=indent, default_flow_style=default_flow_style)
 
+    def render_iter(self, obj, **opts):
+        indent = opts.pop('indent', None)
+        default_flow_style = opts.pop('default_flow_style', None)
+        continuation = opts.pop('continuation', False)
+
+        if not _is_list(obj) or default_flow_style:
+            yield self.render(obj, indent=indent,
+                              default_flow_style=default_flow_style)
+            return
+
+        # A list of objects is rendered in block style, so each item may be
+        # rendered independently.  A list of plain values is rendered in
+        # flow style, so needs to be rendered in one go.
+        items = iter(obj)
+        for item in items:
+            if not isinstance(item, dict):
+                yield self.render([item] + list(items), indent=indent,
+                                  default_flow_style=default_flow_style)
+                return
+            yield self.render([item], indent=indent,
+                              default_flow_style=default_flow_style)
+            break
+        else:
+            if not continuation:
+                yield self.render([], indent=indent,
+                                  default_flow_style=default_flow_style)
+            return
+
+        for item in items:
+            yield self.render([item], indent=indent,
+                              default_flow_style=default_flow_style)
+
 
 class XMLRenderer(BaseRenderer):
     """
@@ -50,13 +223,24 @@ class XMLRenderer(BaseRenderer):
     than as a proposed final XML renderer.
     """
     def render(self, obj, **opts):
+        return ''.join(self.render_iter(obj, **opts))
+
+    def render_iter(self, obj, **opts):
         stream = StringIO.StringIO()
 
         xml = SimplerXMLGenerator(stream, "utf-8")
         xml.startDocument()
-        self._to_xml(xml, obj)
-        xml.endDocument()
-        return stream.getvalue()
+        if opts.get('continuation', False):
+            _drain(stream)
+        if _is_list(obj):
+            for item in obj:
+                self._to_xml(xml, [item])
+                yield _drain(stream)
+        else:
+            self._to_xml(xml, obj)
+        if not opts.get('partial', False):
+            xml.endDocument()
+            yield _drain(stream)
 
     def _to_xml(self, xml, data):
         if isinstance(data, (list, tuple)):
@@ -83,25 +267,47 @@ class DumpDataXMLRenderer(BaseRenderer):
     Note that this renderer is included more by way of example,
     than as a proposed final XML renderer.
     """
+    columnar = False
+
     def render(self, obj, **opts):
+        return ''.join(self.render_iter(obj, **opts))
+
+    def render_iter(self, obj, **opts):
         stream = StringIO.StringIO()
+        self.layouts = {}
 
         xml = SimplerXMLGenerator(stream, "utf-8")
         xml.startDocument()
         xml.startElement("django-objects", {"version": "1.0"})
-        if isinstance(obj, (list, tuple)):
-            [self.model_to_xml(xml, item) for item in obj]
+        if opts.get('continuation', False):
+            _drain(stream)
+        if _is_list(obj):
+            for item in obj:
+                self.model_to_xml(stream, item)
+                yield _drain(stream)
         else:
-            self.model_to_xml(xml, obj)
-        xml.endElement("django-objects")
-        xml.endDocument()
-        return stream.getvalue()
-
-    def model_to_xml(self, xml, data):
-        pk = unicode(data['pk'])
-        model = data['model']
+            self.model_to_xml(stream, obj)
+        if not opts.get('partial', False):
+            xml.endElement("django-objects")
+            xml.endDocument()
+            yield _drain(stream)
+
+    def get_layout(self, data):
+        """
+        Return a tuple of `(object_end, fields)` for objects of the same
+        model, with the same fields, as the given serialized object, where
+        `object_end` is the rest of the object's start tag after the pk, and
+        `fields` is a list of `(key, field_start, rel)` tuples.
+
+        The fragments give the same output as `SimplerXMLGenerator` would,
+        but are only built once per model, rather than once per object.
+        """
         fields = data['fields']
-        xml.startElement("object", {'pk': pk, 'model': model})
+        layout_key = (data['model'], tuple(fields.keys()))
+        try:
+            return self.layouts[layout_key]
+        except KeyError:
+            pass
 
         # Due to implmentation details, the existing xml dumpdata format
         # renders ordered fields, whilst json and yaml render unordered
@@ -110,21 +316,64 @@ class DumpDataXMLRenderer(BaseRenderer):
         # we'll deal with that now.
         sorted_items = sorted(fields.items_with_metadata(),
                               key=lambda x: x[2].creation_counter)
-
+        field_layout = []
         for key, value, field in sorted_items:
             attrs = {'name': key}
             attrs.update(field.attributes())
-            xml.startElement('field', attrs)
-            if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
-                xml.characters(value.isoformat())
-            elif value is not None:
-                xml.characters(smart_unicode(value))
-            xml.endElement('field')
-        xml.endElement("object")
+            field_start = u'<field%s>' % u''.join([
+                u' %s=%s' % (name, quoteattr(value))
+                for (name, value) in attrs.items()
+            ])
+            field_layout.append((key, field_start, attrs.get('rel')))
+
+        object_end = u' model=%s>' % quoteattr(data['model'])
+        layout = (object_end, field_layout)
+        self.layouts[layout_key] = layout
+        return layout
+
+    def model_to_xml(self, stream, data):
+        object_end, field_layout = self.get_layout(data)
+        fields = data['fields']
+        parts = [u'<object pk=', quoteattr(unicode(data['pk'])), object_end]
+        for key, field_start, rel in field_layout:
+            parts.append(field_start)
+            value = fields[key]
+            if value is None:
+                parts.append(u'<None></None>')
+            elif rel and isinstance(value, (list, tuple)):
+                parts.append(self.related_to_xml(value, rel))
+            elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+                parts.append(escape(value.isoformat()))
+            else:
+                parts.append(escape(smart_unicode(value)))
+            parts.append(u'</field>')
+        parts.append(u'</object>')
+        stream.write(u''.join(parts).encode('utf-8'))
+
+    def related_to_xml(self, value, rel):
+        """
+        Return the xml for a natural foreign key, or the primary or natural
+        keys of a many to many field, as Django's xml serializer writes them.
+        """
+        if rel != 'ManyToManyRel':
+            return _natural_key_to_xml(value)
+        parts = []
+        for item in value:
+            if isinstance(item, (list, tuple)):
+                parts.append(u'<object>%s</object>' % _natural_key_to_xml(item))
+            else:
+                parts.append(u'<object pk=%s></object>' %
+                             quoteattr(smart_unicode(item)))
+        return u''.join(parts)
 
 
 class CSVRenderer(BaseRenderer):
+    columnar = False
+
     def render(self, obj, **opts):
+        return ''.join(self.render_iter(obj, **opts))
+
+    def render_iter(self, obj, **opts):
         if not hasattr(obj, '__iter__'):
             obj = [obj]
         stream = StringIO.StringIO()
@@ -133,8 +382,10 @@ class CSVRenderer(BaseRenderer):
             if not writer:
                 writer = DictWriter(stream, item.keys())
                 writer.writeheader()
+                if opts.get('continuation', False):
+                    _drain(stream)
             writer.writerow(item)
-        return stream.getvalue()
+            yield _drain(stream)
 
 if not yaml:
     YAMLRenderer = None
@@ -1,18 +1,46 @@
 from decimal import Decimal
 from django.utils.datastructures import SortedDict
+from django.utils.encoding import smart_str
+from django.utils.importlib import import_module
 import copy
 import datetime
+import hashlib
 import inspect
 import types
-from serializers.renderers import (
-    JSONRenderer,
-    YAMLRenderer,
-    XMLRenderer,
-    CSVRenderer,
-    DumpDataXMLRenderer
-)
 from serializers.fields import *
-from serializers.utils import DictWithMetadata, SortedDictWithMetadata
+from serializers.fields import (
+    _get_ordering,
+    _get_prefetched_limited,
+    _get_registered_converter,
+    _prefetch_limited,
+    _prefetch_related,
+    _type_caches
+)
+from serializers.compiler import compile_plan, compile_values
+from serializers import metrics
+from serializers.pagination import (
+    get_keyset_ordering,
+    encode_cursor,
+    decode_cursor,
+    keyset_filter
+)
+from serializers.queries import QueryTracker
+from serializers.utils import (
+    DictWithMetadata,
+    SortedDictWithMetadata,
+    LazySerializedList,
+    DigestIterator,
+    compress_iter
+)
+
+
+_native_types = (
+    types.NoneType,
+    int, long,
+    datetime.datetime, datetime.date, datetime.time,
+    float, Decimal,
+    basestring
+)
 
 
 def _remove_items(seq, exclude):
@@ -51,6 +79,135 @@ def _get_declared_fields(bases, attrs):
     return SortedDict(fields)
 
 
+def _to_numpy_array(values):
+    """
+    Return a numpy array for a column of numeric values, or the values
+    unchanged for any other column.
+    """
+    import numpy
+    if values and all(type(value) in (int, long, float) for value in values):
+        return numpy.array(values)
+    return values
+
+
+_transformed_keys = {}
+_imported = {}
+
+# Constructor arguments that don't change which fields are serialized.
+_field_kwargs = ('source', 'label', 'serialize', 'memoize', 'memoize_size')
+
+
+def _get_options_key(kwargs):
+    """
+    Return a hashable key for the options that a serializer was created
+    with, or `None` if they can't be hashed.
+    """
+    items = []
+    for key, value in sorted(kwargs.items()):
+        if key in _field_kwargs:
+            continue
+        if isinstance(value, list):
+            value = tuple(value)
+        items.append((key, value))
+    items = tuple(items)
+    try:
+        hash(items)
+    except TypeError:
+        return None
+    return items
+
+
+def _describe(value):
+    """
+    Return a description of an option's value that is the same in every
+    process, naming classes and functions by their module, rather than by
+    their address.
+    """
+    if isinstance(value, (list, tuple)):
+        return '(%s)' % ', '.join([_describe(item) for item in value])
+    if hasattr(value, '__module__') and hasattr(value, '__name__'):
+        return '%s.%s' % (value.__module__, value.__name__)
+    return repr(value)
+
+
+def _serialize_native(serializer, obj):
+    return obj
+
+
+def _serialize_callable(serializer, obj):
+    if serializer._is_simple_callable(obj):
+        return serializer.serialize(obj())
+    return serializer.serialize_object(obj)
+
+
+def _serialize_list(serializer, obj):
+    return [serializer._serialize_item(item) for item in obj]
+
+
+def _get_forward_path(model, source):
+    """
+    Given a dotted `source`, return the `select_related` path for the forward
+    foreign keys and one to one fields that it follows from the model, such as
+    'owner__profile' for 'owner.profile.email', or an empty string.
+    """
+    path = []
+    for name in source.split('.')[:-1]:
+        try:
+            field, _, direct, m2m = model._meta.get_field_by_name(name)
+        except Exception:
+            break
+        if not direct or m2m or not field.rel:
+            break
+        path.append(name)
+        model = field.rel.to
+    return '__'.join(path)
+
+
+def _serialize_manager(serializer, obj):
+    items = serializer._iter_prefetched(serializer._get_queryset(obj))
+    return [serializer._serialize_item(item) for item in items]
+
+
+def _serialize_model_list(serializer, obj):
+    items = serializer._iter_prefetched(obj)
+    return [serializer._serialize_item(item) for item in items]
+
+
+def _serialize_object(serializer, obj):
+    return serializer.serialize_object(obj)
+
+
+def _serialize_registered(convert):
+    return lambda serializer, obj: convert(obj)
+
+
+def _transform_key(key_transform, key):
+    """
+    Apply a `key_transform` function to a key.  The results are memoized,
+    as the same keys are transformed over and over again.
+    """
+    try:
+        return _transformed_keys[(key_transform, key)]
+    except KeyError:
+        ret = key_transform(key)
+        _transformed_keys[(key_transform, key)] = ret
+        return ret
+
+
+def _import_string(path):
+    """
+    Return the object at a dotted path, such as
+    'serializers.renderers.JSONRenderer', importing it the first time.
+    """
+    try:
+        return _imported[path]
+    except KeyError:
+        module_name, name = path.rsplit('.', 1)
+        ret = getattr(import_module(module_name), name)
+        _imported[path] = ret
+        return ret
+
+
 def _get_option(name, kwargs, meta, default):
     return kwargs.get(name, getattr(meta, name, default))
 
@@ -67,6 +224,12 @@ class SerializerOptions(object):
         self.flat_field = _get_option('flat_field', kwargs, meta, Field)
         self.recursive_field = _get_option('recursive_field', kwargs, meta, None)
         self.nested_field = _get_option('nested_field', kwargs, meta, None)
+        self.cache_plans = _get_option('cache_plans', kwargs, meta, False)
+        self.compile = _get_option('compile', kwargs, meta, False)
+        self.direct_json = _get_option('direct_json', kwargs, meta, False)
+        key_transform = _get_option('key_transform', kwargs, meta, None)
+        # Functions declared on `Meta` are returned as unbound methods.
+        self.key_transform = getattr(key_transform, 'im_func', key_transform)
 
 
 class ModelSerializerOptions(SerializerOptions):
@@ -75,11 +238,17 @@ class ModelSerializerOptions(SerializerOptions):
         self.model_field_types = _get_option('model_field_types', kwargs, meta, None)
         self.model_field = _get_option('model_field', kwargs, meta, ModelField)
         self.related_field = _get_option('related_field', kwargs, meta, PrimaryKeyRelatedField)
+        self.prefetch_chunk_size = _get_option('prefetch_chunk_size', kwargs, meta, 500)
+        self.version_field = _get_option('version_field', kwargs, meta, None)
+        self.max_items = _get_option('max_items', kwargs, meta, None)
 
 
 class SerializerMetaclass(type):
     def __new__(cls, name, bases, attrs):
         attrs['base_fields'] = _get_declared_fields(bases, attrs)
+        attrs['_type_dispatch'] = {}
+        attrs['_plan_specs'] = {}
+        _type_caches.append(attrs['_type_dispatch'])
         return super(SerializerMetaclass, cls).__new__(cls, name, bases, attrs)
 
 
@@ -87,24 +256,36 @@ class BaseSerializer(Field):
     class Meta(object):
         pass
 
+    # Renderers may be given as dotted paths, so that they are only
+    # imported when a format is first used.
     renderer_classes = {
-        'xml': XMLRenderer,
-        'json': JSONRenderer,
-        'yaml': YAMLRenderer,
-        'csv': CSVRenderer,
+        'xml': 'serializers.renderers.XMLRenderer',
+        'json': 'serializers.renderers.JSONRenderer',
+        'yaml': 'serializers.renderers.YAMLRenderer',
+        'csv': 'serializers.renderers.CSVRenderer',
     }
 
     options_class = SerializerOptions
     _use_sorted_dict = True
+    _type_dispatch = {}
+    _type_caches.append(_type_dispatch)
+    _plan_specs = {}
 
     def __init__(self, **kwargs):
         source = kwargs.get('source', None)
         label = kwargs.get('label', None)
         serialize = kwargs.get('serialize', None)
-        super(BaseSerializer, self).__init__(source=source, label=label, serialize=serialize)
+        memoize = kwargs.get('memoize', None)
+        memoize_size = kwargs.get('memoize_size', None)
+        super(BaseSerializer, self).__init__(source=source, label=label, serialize=serialize,
+                                             memoize=memoize, memoize_size=memoize_size)
 
         self.opts = self.options_class(self.Meta, **kwargs)
+        self._options_key = _get_options_key(kwargs)
         self.stack = []
+        self.memos = {}
+        self._field_plans = None
+        self._compiled_plans = None
         self.fields = SortedDict((key, copy.copy(field))
                            for key, field in self.base_fields.items())
 
@@ -124,13 +305,24 @@ class BaseSerializer(Field):
         True if the object is a native datatype that does not need to
         be serialized further.
         """
-        return isinstance(obj, (
-            types.NoneType,
-            int, long,
-            datetime.datetime, datetime.date, datetime.time,
-            float, Decimal,
-            basestring)
-        )
+        return isinstance(obj, _native_types)
+
+    def _get_type_converter(self, cls):
+        """
+        Return the function that `serialize` uses for objects of the given
+        type.  The result is cached, so this is only called the first time
+        each type is seen.
+        """
+        convert = _get_registered_converter(cls)
+        if convert is not None:
+            return _serialize_registered(convert)
+        elif issubclass(cls, _native_types):
+            return _serialize_native
+        elif cls in (types.FunctionType, types.MethodType):
+            return _serialize_callable
+        elif hasattr(cls, '__iter__'):
+            return _serialize_list
+        return _serialize_object
 
     def _is_simple_callable(self, obj):
         """
@@ -165,6 +357,98 @@ class BaseSerializer(Field):
         except KeyError:
             return self._get_default_field_serializer(obj, field_name)
 
+    def _get_field_plan(self, obj, force_cache=False):
+        """
+        Given an object, return a list of `(field_name, key, field)` tuples
+        describing how it should be serialized.
+
+        If the `cache_plans` option is set, or `force_cache` is, then plans
+        are cached for objects that share the same `get_plan_key()`, so that
+        field names, keys and default field instances are only determined
+        once, rather than once per object.
+
+        The field names and keys of cached plans are also shared with other
+        instances of the same class that were created with the same options,
+        so that they are determined once per process.  Field instances are
+        not shared.
+        """
+        plan_key = self._get_plan_cache_key(obj, force_cache)
+        if plan_key is None:
+            return self._build_field_plan(obj)
+
+        if self._field_plans is None:
+            self._field_plans = {}
+        try:
+            return self._field_plans[plan_key]
+        except KeyError:
+            pass
+
+        spec_key = self._get_plan_spec_key(plan_key)
+        spec = spec_key is not None and self._plan_specs.get(spec_key) or None
+        if spec is None:
+            plan = self._build_field_plan(obj)
+            if spec_key is not None:
+                self._plan_specs[spec_key] = [(field_name, key) for
+                                              (field_name, key, field) in plan]
+        else:
+            plan = [(field_name, key, self._get_field_serializer(obj, field_name))
+                    for (field_name, key) in spec]
+        self._field_plans[plan_key] = plan
+        return plan
+
+    def _build_field_plan(self, obj):
+        plan = []
+        for field_name in self._get_field_names(obj):
+            field = self._get_field_serializer(obj, field_name)
+            key = self.get_field_key(obj, field_name, field)
+            if self.opts.key_transform:
+                key = _transform_key(self.opts.key_transform, key)
+            plan.append((field_name, key, field))
+        return plan
+
+    def _get_plan_spec_key(self, plan_key):
+        """
+        Return the key that the field names and keys of a plan are shared
+        between instances with, or `None` if they shouldn't be shared.
+        """
+        if self._options_key is None:
+            return None
+        fields = tuple([(field_name, field.__class__)
+                        for field_name, field in self.fields.items()])
+        return (self.__class__, self._options_key, fields, plan_key)
+
+    def _get_plan_cache_key(self, obj, force_cache=False):
+        """
+        Return the key that the plan for an object is cached with, or `None`
+        if it should not be cached.  The `compile` and `direct_json` options
+        work from cached plans, so they imply `cache_plans`.
+        """
+        opts = self.opts
+        if not (force_cache or opts.cache_plans or opts.compile or
+                opts.direct_json):
+            return None
+        plan_key = self.get_plan_key(obj)
+        if plan_key is None:
+            return None
+        return (plan_key, self.opts.depth)
+
+    def _get_compiled_plan(self, obj):
+        """
+        Return a generated function that serializes the object, or `None`
+        if the object's field plan is not cached.
+        """
+        plan_key = self._get_plan_cache_key(obj)
+        if plan_key is None:
+            return None
+        if self._compiled_plans is None:
+            self._compiled_plans = {}
+        try:
+            return self._compiled_plans[plan_key]
+        except KeyError:
+            ret = compile_plan(self, self._get_field_plan(obj), obj)
+            self._compiled_plans[plan_key] = ret
+            return ret
+
     def _get_default_field_serializer(self, obj, field_name):
         """
         If a field does not have an explicitly declared serializer, return the
@@ -183,6 +467,33 @@ class BaseSerializer(Field):
         return sorted([key for key in obj.__dict__.keys()
                        if not(key.startswith('_'))])
 
+    def get_plan_key(self, obj):
+        """
+        Return a hashable key identifying objects that are always serialized
+        with the same set of fields, or `None` if the fields need to be
+        determined for each object individually.
+        """
+        return None
+
+    def get_memo_stats(self):
+        """
+        Return a dict of the number of `hits` and `misses`, and the `hit_rate`,
+        of each memoized field, including those of nested serializers, which
+        are given as dotted names.
+        """
+        ret = {}
+        for field_name, field in self.fields.items():
+            if field.memoize is not None:
+                ret[field_name] = {
+                    'hits': field.memo_hits,
+                    'misses': field.memo_misses,
+                    'hit_rate': field.get_memo_hit_rate()
+                }
+            if isinstance(field, BaseSerializer):
+                for name, stats in field.get_memo_stats().items():
+                    ret['%s.%s' % (field_name, name)] = stats
+        return ret
+
     def get_field_key(self, obj, field_name, field):
         """
         Return the key that should be used for a given field.
@@ -196,15 +507,22 @@ class BaseSerializer(Field):
         Same behaviour as usual Field, except that we need to keep track
         of state so that we can deal with handling maximum depth and recursion.
         """
+        self._set_parent(obj, field_name, parent)
+        return super(BaseSerializer, self)._serialize_field(obj, field_name, parent)
+
+    def _set_parent(self, obj, field_name, parent):
         self.parent = parent
         self.orig_obj = obj
         self.orig_field_name = field_name
 
         self.stack = parent.stack[:]
+        self.memos = parent.memos
         if parent.opts.depth is not None:
             self.opts.depth = parent.opts.depth - 1
-
-        return super(BaseSerializer, self)._serialize_field(obj, field_name, parent)
+        if parent.opts.cache_plans:
+            self.opts.cache_plans = True
+        if parent.opts.compile:
+            self.opts.compile = True
 
     def serialize_object(self, obj):
         if self.source != '*' and obj in self.stack:
@@ -215,36 +533,408 @@ class BaseSerializer(Field):
                                                self)
         self.stack.append(obj)
 
+        if self.opts.compile:
+            serialize_plan = self._get_compiled_plan(obj)
+            if serialize_plan is not None:
+                return serialize_plan(self, obj)
+
         if self._use_sorted_dict:
             ret = SortedDictWithMetadata()
         else:
             ret = DictWithMetadata()
 
-        for field_name in self._get_field_names(obj):
-            field = self._get_field_serializer(obj, field_name)
-            key = self.get_field_key(obj, field_name, field)
+        for field_name, key, field in self._get_field_plan(obj):
             value = field._serialize_field(obj, field_name, self)
             ret.set_with_metadata(key, value, field)
         return ret
 
+    def serialize_columns(self, obj, layout='columns', numpy_arrays=False):
+        """
+        Serializes a homogeneous list of objects into a columnar structure,
+        with the keys given once in a `fields` header, rather than repeated
+        for every object.
+
+        `layout` may be either 'columns', giving a list of values per key,
+        or 'rows', giving a list of values per object.  If `numpy_arrays` is
+        set, numeric columns are returned as numpy arrays.
+
+        Every object must have the same fields, so the field plan is cached
+        whether or not the `cache_plans` option is set.
+        """
+        if layout not in ('columns', 'rows'):
+            raise ValueError("Unknown columnar layout '%s'" % layout)
+        if numpy_arrays:
+            try:
+                import numpy
+            except ImportError:
+                raise ImportError("numpy_arrays requires numpy to be installed")
+        if not hasattr(obj, '__iter__'):
+            obj = [obj]
+
+        keys = None
+        columns = []
+        rows = []
+        last_plan = None
+        stack_size = len(self.stack)
+        for item in obj:
+            # As for `_serialize_item`, each row is dropped from the stack
+            # afterwards, so that memory use does not grow with the list.
+            del self.stack[stack_size:]
+            self.stack.append(item)
+            plan = self._get_field_plan(item, True)
+            if plan is not last_plan:
+                plan_keys = [key for (field_name, key, field) in plan]
+                if keys is None:
+                    keys = plan_keys
+                    columns = [[] for key in keys]
+                elif plan_keys != keys:
+                    raise ValueError("Columnar serialization requires every "
+                                     "object to have the same fields")
+                last_plan = plan
+            row = [field._serialize_field(item, field_name, self)
+                   for (field_name, key, field) in plan]
+            if layout == 'rows':
+                rows.append(row)
+            else:
+                for column, value in zip(columns, row):
+                    column.append(value)
+
+        del self.stack[stack_size:]
+        keys = keys or []
+        if layout == 'rows':
+            return SortedDict((('fields', keys), ('rows', rows)))
+
+        if numpy_arrays:
+            columns = [_to_numpy_array(column) for column in columns]
+        return SortedDict((('fields', keys),
+                           ('columns', SortedDict(zip(keys, columns)))))
+
     def serialize(self, obj):
-        if self._is_protected_type(obj):
-            return obj
-        elif self._is_simple_callable(obj):
-            return self.serialize(obj())
-        elif hasattr(obj, '__iter__'):
-            return [self.serialize(item) for item in obj]
-        return self.serialize_object(obj)
+        try:
+            convert = self._type_dispatch[obj.__class__]
+        except KeyError:
+            convert = self._get_type_converter(obj.__class__)
+            self._type_dispatch[obj.__class__] = convert
+        return convert(self, obj)
+
+    def serialize_iter(self, obj):
+        """
+        If the object is a list-like, return an iterator that serializes each
+        item as it is consumed.  Otherwise return the serialized object.
+        """
+        if (self._is_protected_type(obj) or
+            self._is_simple_callable(obj) or
+            not hasattr(obj, '__iter__')):
+            return self.serialize(obj)
+        return self._serialize_items(obj)
+
+    def serialize_lazy(self, obj):
+        """
+        If the object is a list-like, return a `LazySerializedList`, that
+        serializes each item as it is accessed.  Otherwise return the
+        serialized object.
+        """
+        if (self._is_protected_type(obj) or
+            self._is_simple_callable(obj) or
+            not hasattr(obj, '__iter__')):
+            return self.serialize(obj)
+        return LazySerializedList(obj, self._serialize_item)
+
+    def _serialize_item(self, item):
+        # Each item is serialized independently, and dropped from the stack
+        # afterwards, so that memory use does not grow with the list.
+        stack_size = len(self.stack)
+        ret = self.serialize(item)
+        del self.stack[stack_size:]
+        return ret
+
+    def _serialize_items(self, items):
+        for item in items:
+            yield self._serialize_item(item)
+
+    def _get_json_plan(self, obj, plan):
+        """
+        Return a tuple of `(nested, plan_values)` for writing objects with the
+        given field plan as json.  `nested` is the set of plan indexes of
+        serializers with `source='*'`, which are written directly too, and
+        `plan_values` is a generated function returning the values of the
+        other fields, or `None` if the `compile` option is not set.
+        """
+        plan_key = (self._get_plan_cache_key(obj), 'json')
+        if self._compiled_plans is None:
+            self._compiled_plans = {}
+        try:
+            return self._compiled_plans[plan_key]
+        except KeyError:
+            pass
+
+        nested = frozenset([
+            index for (index, (field_name, key, field)) in enumerate(plan)
+            if isinstance(field, BaseSerializer) and field.source == '*' and
+            field.__class__._serialize_field.im_func is
+            BaseSerializer._serialize_field.im_func
+        ])
+        plan_values = None
+        if self.opts.compile:
+            plan_values = compile_values(plan, obj, nested)
+        ret = (nested, plan_values)
+        self._compiled_plans[plan_key] = ret
+        return ret
+
+    def _can_write_json(self, obj):
+        """
+        Return `True` if the object can be written directly as json from its
+        cached field plan, rather than being serialized first.
+        """
+        try:
+            convert = self._type_dispatch[obj.__class__]
+        except KeyError:
+            convert = self._get_type_converter(obj.__class__)
+            self._type_dispatch[obj.__class__] = convert
+        return (convert is _serialize_object and
+                'serialize' not in self.__dict__ and
+                (self.source == '*' or obj not in self.stack) and
+                self._get_plan_cache_key(obj) is not None)
+
+    def _write_json(self, obj, writer, level):
+        """
+        Return the json text for `obj`, exactly as `JSONRenderer` would render
+        `self.serialize(obj)`, but without building the intermediate dicts.
+        """
+        if not self._can_write_json(obj):
+            return writer.encode(self.serialize(obj), level)
+
+        plan = self._get_field_plan(obj)
+        layout = writer.get_layout(plan, level, self._use_sorted_dict)
+        if layout is None:
+            return writer.encode(self.serialize_object(obj), level)
+        self.stack.append(obj)
+
+        nested, plan_values = self._get_json_plan(obj, plan)
+        if plan_values is not None:
+            values = list(plan_values(self, obj))
+        else:
+            values = [None if index in nested else
+                      field._serialize_field(obj, field_name, self)
+                      for (index, (field_name, key, field)) in enumerate(plan)]
+
+        chunks = []
+        fragments, end = layout
+        for index, fragment in fragments:
+            chunks.append(fragment)
+            if index in nested:
+                field_name, key, field = plan[index]
+                field._set_parent(obj, field_name, self)
+                field.obj = obj
+                chunks.append(field._write_json(obj, writer, level + 1))
+            else:
+                chunks.append(writer.encode(values[index], level + 1))
+        chunks.append(end)
+        return ''.join(chunks)
+
+    def _iter_json(self, obj, indent=None, sort_keys=False):
+        """
+        Yield chunks of json for `obj`, writing model instances directly as
+        json text, for serializers that set the `direct_json` option.
+        """
+        JSONWriter = _import_string('serializers.jsonwriter.JSONWriter')
+        writer = JSONWriter(indent=indent, sort_keys=sort_keys)
+        if (self._is_protected_type(obj) or
+            self._is_simple_callable(obj) or
+            not hasattr(obj, '__iter__')):
+            yield self._write_json(obj, writer, 0)
+            return
+
+        start, separator, end = writer.list_fragments(0)
+        empty = True
+        for item in obj:
+            yield start if empty else separator
+            empty = False
+            stack_size = len(self.stack)
+            yield self._write_json(item, writer, 1)
+            del self.stack[stack_size:]
+        yield '[]' if empty else end
+
+    def encode_iter(self, obj, format, **opts):
+        """
+        Same as `encode`, but returns an iterator over chunks of the rendered
+        output, serializing list items as the output is consumed.
+
+        If `compress` is set to either 'gzip' or 'bz2', the iterator returns
+        chunks of the compressed output instead.
+
+        If `digest` is set to a hash algorithm, such as 'md5' or 'sha1', then
+        a digest of the output is computed as it is consumed, and is returned
+        by the iterator's `hexdigest()` method once it has been exhausted.
+        """
+        compress = opts.pop('compress', None)
+        compresslevel = opts.pop('compresslevel', 9)
+        digest = opts.pop('digest', None)
+        if not format:
+            raise ValueError("encode_iter() requires a format")
+        if opts.get('columnar', None):
+            raise ValueError("Columnar output can't be streamed, "
+                             "use encode() instead")
+        self.stack = []
+        self.memos = {}
+        measured = metrics.backend.enabled
+        if measured:
+            start = metrics.timer()
+            tracker = QueryTracker()
+        objects = None
+        if (format == 'json' and self.opts.direct_json and
+            not opts.get('continuation', False)):
+            chunks = self._iter_json(obj, opts.get('indent', None),
+                                     opts.get('sort_keys', False))
+        elif measured:
+            # Single objects are serialized straight away, rather than as
+            # the output is consumed.
+            with tracker:
+                data = self.serialize_iter(obj)
+            if isinstance(data, types.GeneratorType):
+                data = objects = metrics.CountingIterator(data)
+            else:
+                objects = metrics.count_objects(data)
+            chunks = self.render_iter(data, format, **opts)
+        else:
+            data = self.serialize_iter(obj)
+            chunks = self.render_iter(data, format, **opts)
+        chunks = self._discard_memos(chunks)
+        if compress:
+            chunks = compress_iter(chunks, compress, compresslevel)
+        if measured:
+            chunks = metrics.measure_iter(chunks, self.get_metric_tags(format),
+                                          objects, start, tracker)
+        if digest:
+            return DigestIterator(chunks, digest)
+        return chunks
+
+    def _discard_memos(self, chunks):
+        """
+        Yield the chunks of an encode, discarding the related objects that
+        were loaded for it once the output has been consumed.
+        """
+        memos = self.memos
+        try:
+            for chunk in chunks:
+                yield chunk
+        finally:
+            if self.memos is memos:
+                self.memos = {}
 
     def encode(self, obj, format=None, **opts):
-        data = self.serialize(obj)
+        max_queries = opts.pop('max_queries', None)
+        if max_queries is not None:
+            action = opts.pop('query_budget_action', 'raise')
+            with QueryTracker(max_queries, action):
+                return self.encode(obj, format, **opts)
+
+        digest = opts.pop('digest', None)
+        if digest:
+            if not format:
+                raise ValueError("A format is required to compute a digest")
+            if opts.get('columnar', None):
+                # Columnar output is built as a whole, so it's hashed once
+                # it has been rendered.
+                chunks = DigestIterator([self.encode(obj, format, **opts)],
+                                        digest)
+            else:
+                # The digest is computed while the output is streamed, rather
+                # than hashing the complete output afterwards.
+                chunks = self.encode_iter(obj, format, digest=digest, **opts)
+            return ''.join(chunks), chunks.hexdigest()
+
+        try:
+            if metrics.backend.enabled:
+                return self._encode_measured(obj, format, opts)
+            return self._encode(obj, format, opts)[0]
+        finally:
+            # Related objects loaded for this encode aren't kept, so that
+            # later calls see any changes to them.
+            self.memos = {}
+
+    def _encode(self, obj, format, opts, tags=None):
+        """
+        Serialize and render an object, returning a tuple of the result,
+        and the number of serialized objects, if known.  If `tags` are given,
+        then the time taken to serialize is reported to the metrics backend.
+        """
+        columnar = opts.pop('columnar', None)
+        numpy_arrays = opts.pop('numpy_arrays', False)
+        if (columnar and format and
+            not self.get_renderer_class(format).columnar):
+            raise ValueError("Columnar output can't be rendered as '%s'" % format)
+        self.stack = []
+        self.memos = {}
+        if columnar:
+            layout = columnar if columnar in ('columns', 'rows') else 'columns'
+            data = self.serialize_columns(obj, layout,
+                                          numpy_arrays and not format)
+            objects = None
+        elif format == 'json' and self.opts.direct_json:
+            return ''.join(self._iter_json(obj, opts.get('indent', None),
+                                           opts.get('sort_keys', False))), None
+        elif tags is not None:
+            start = metrics.timer()
+            data = self.serialize(obj)
+            objects = metrics.count_objects(data)
+            metrics.backend.record('serialize', tags, metrics.timer() - start,
+                                   objects=objects)
+        else:
+            data = self.serialize(obj)
+            objects = None
         if format:
-            return self.render(data, format, **opts)
-        return data
+            return self.render(data, format, **opts), objects
+        return data, objects
+
+    def _encode_measured(self, obj, format, opts):
+        tags = self.get_metric_tags(format)
+        start = metrics.timer()
+        with QueryTracker() as tracker:
+            ret, objects = self._encode(obj, format, opts, tags)
+        metrics.backend.record('encode', tags, metrics.timer() - start,
+                               objects=objects,
+                               bytes=len(ret) if format else None,
+                               queries=tracker.count)
+        return ret
+
+    def get_metric_tags(self, format):
+        """
+        Return the tags that metrics for this serializer are reported with.
+        """
+        return {'serializer': self.__class__.__name__, 'format': format}
+
+    def get_renderer_class(self, format):
+        renderer_class = self.renderer_classes[format]
+        if isinstance(renderer_class, basestring):
+            renderer_class = _import_string(renderer_class)
+        return renderer_class
 
     def render(self, data, format, **opts):
-        renderer = self.renderer_classes[format]()
-        return renderer.render(data, **opts)
+        """
+        Render serialized data.  If `workers` is set, then large lists are
+        split into chunks of `chunk_size` items, which are rendered in that
+        many processes.
+        """
+        if not metrics.backend.enabled:
+            return self._render(data, format, opts)
+        start = metrics.timer()
+        ret = self._render(data, format, opts)
+        metrics.backend.record('render', self.get_metric_tags(format),
+                               metrics.timer() - start, bytes=len(ret))
+        return ret
+
+    def _render(self, data, format, opts):
+        renderer_class = self.get_renderer_class(format)
+        workers = opts.pop('workers', None)
+        if workers and workers != 1:
+            render_parallel = _import_string('serializers.parallel.render_parallel')
+            return render_parallel(renderer_class, data, workers, **opts)
+        return renderer_class().render(data, **opts)
+
+    def render_iter(self, data, format, **opts):
+        renderer = self.get_renderer_class(format)()
+        return renderer.render_iter(data, **opts)
 
 
 class Serializer(BaseSerializer):
@@ -281,6 +971,15 @@ class ModelSerializer(Serializer):
                 ])
         return [field.name for field in fields]
 
+    def get_plan_key(self, obj):
+        """
+        Model instances of the same class are always serialized with the
+        same set of fields.
+        """
+        if hasattr(obj, '_meta'):
+            return obj.__class__
+        return None
+
     def get_related_serializer(self, obj, field_name):
         return self.opts.related_field()
 
@@ -293,16 +992,256 @@ class ModelSerializer(Serializer):
         except FieldDoesNotExist:
             return self.opts.flat_field()
 
-    def serialize(self, obj):
-        if self._is_protected_type(obj):
-            return obj
-        elif self._is_simple_callable(obj):
-            return self.serialize(obj())
-        elif hasattr(obj, 'all') and self._is_simple_callable(obj.all):
-            return [self.serialize(item) for item in obj.all()]
-        elif hasattr(obj, '__iter__'):
-            return [self.serialize(item) for item in obj]
-        return self.serialize_object(obj)
+    def _get_type_converter(self, cls):
+        """
+        Managers and querysets are serialized as lists of model instances.
+        Other lists have the related objects of their items loaded in bulk.
+        """
+        convert = super(ModelSerializer, self)._get_type_converter(cls)
+        if (convert in (_serialize_list, _serialize_object) and
+            hasattr(cls, 'all') and self._is_simple_callable(cls.all)):
+            return _serialize_manager
+        if convert is _serialize_list:
+            return _serialize_model_list
+        return convert
+
+    def prefetch_related(self, objs, field_name):
+        """
+        Load the related objects of a nested relationship in bulk, and then
+        anything that their own fields need.
+        """
+        if self.source == '*':
+            self._prefetch(objs)
+            return
+        related = None
+        if self.opts.max_items is not None:
+            related = _prefetch_limited(objs, self.source or field_name,
+                                        self.opts.max_items, self.memos,
+                                        self._get_queryset)
+        if related is None:
+            related = _prefetch_related(objs, self.source or field_name,
+                                        single=True)
+        if not related:
+            return
+        # Don't follow cycles of relationships when there is no maximum depth.
+        if (self.opts.depth is None and
+            related[0].__class__ in self.parent._prefetched_models):
+            return
+        self._prefetch(related)
+
+    def serialize_field(self, obj, field_name):
+        """
+        Nested reverse foreign key and many to many relationships are limited
+        to `max_items` related objects, if set.
+        """
+        if self.opts.max_items is None:
+            return self.serialize(getattr(obj, field_name))
+        items = _get_prefetched_limited(obj, field_name, self.memos)
+        if items is None:
+            value = getattr(obj, field_name)
+            if not (hasattr(value, 'all') and self._is_simple_callable(value.all)):
+                return self.serialize(value)
+            items = self._get_queryset(value)
+            if items._result_cache is None:
+                items = items.order_by(*_get_ordering(items.model))
+            items = items[:self.opts.max_items]
+        return [self._serialize_item(item) for item in items]
+
+    def _prefetch(self, objs):
+        """
+        Call each field's `prefetch_related` hook for a list of objects.
+        """
+        obj = objs[0]
+        if [item for item in objs if item.__class__ is not obj.__class__]:
+            # Lists that aren't querysets may contain several models.
+            groups = SortedDict()
+            for item in objs:
+                groups.setdefault(item.__class__, []).append(item)
+            for group in groups.values():
+                self._prefetch(group)
+            return
+        parent = getattr(self, 'parent', None)
+        self._prefetched_models = (getattr(parent, '_prefetched_models', ()) +
+                                   (obj.__class__,))
+        if self.get_plan_key(obj) is None:
+            return
+        for field_name, key, field in self._get_field_plan(obj):
+            if isinstance(field, BaseSerializer):
+                field._set_parent(obj, field_name, self)
+            else:
+                field.memos = self.memos
+            if getattr(field, 'load_many', None) is not None:
+                field.load_batch(objs, self)
+            else:
+                field.prefetch_related(objs, field_name)
+
+    def _iter_prefetched(self, items):
+        """
+        Yield the items of a queryset or iterator, loading the related objects
+        of each chunk of `prefetch_chunk_size` items in bulk first.
+        """
+        chunk_size = self.opts.prefetch_chunk_size
+        if not chunk_size or getattr(items, '_result_cache', None) is not None:
+            # Querysets that have already been evaluated are either the
+            # related objects of a prefetched relationship, or were passed in.
+            for item in items:
+                yield item
+            return
+
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                self._prefetch(chunk)
+                for obj in chunk:
+                    yield obj
+                chunk = []
+        if chunk:
+            self._prefetch(chunk)
+            for obj in chunk:
+                yield obj
+
+    def _get_queryset(self, obj):
+        """
+        Return the queryset of a manager or queryset, using `select_related`
+        to follow any forward relationships that dotted `source` fields need,
+        so that they are fetched in the same query.
+        """
+        queryset = obj.all()
+        if queryset._result_cache is not None:
+            # The related objects of a prefetched relationship.
+            return queryset
+        related = self._get_select_related(queryset.model)
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset
+
+    def _get_select_related(self, model):
+        """
+        Return the `select_related` paths for the forward relationships
+        followed by dotted `source` fields, including those of any nested
+        serializers with `source='*'`.
+        """
+        ret = []
+        for field in self.fields.values():
+            if isinstance(field, ModelSerializer) and field.source == '*':
+                ret.extend(field._get_select_related(model))
+            elif field.source and '.' in field.source:
+                path = _get_forward_path(model, field.source)
+                if path and path not in ret:
+                    ret.append(path)
+        return ret
+
+    def serialize_iter(self, obj):
+        if hasattr(obj, 'all') and self._is_simple_callable(obj.all):
+            items = self._iter_prefetched(self._get_queryset(obj).iterator())
+            return self._serialize_items(items)
+        elif isinstance(obj, (list, tuple)):
+            return self._serialize_items(self._iter_prefetched(obj))
+        return super(ModelSerializer, self).serialize_iter(obj)
+
+    def _iter_json(self, obj, indent=None, sort_keys=False):
+        if hasattr(obj, 'all') and self._is_simple_callable(obj.all):
+            obj = self._iter_prefetched(self._get_queryset(obj).iterator())
+        elif isinstance(obj, (list, tuple)):
+            obj = self._iter_prefetched(obj)
+        return super(ModelSerializer, self)._iter_json(obj, indent, sort_keys)
+
+    def serialize_lazy(self, obj):
+        if hasattr(obj, 'all') and self._is_simple_callable(obj.all):
+            return LazySerializedList(self._get_queryset(obj),
+                                      self._serialize_item)
+        return super(ModelSerializer, self).serialize_lazy(obj)
+
+    def fingerprint(self, obj, format=None, algorithm='md5', **opts):
+        """
+        Return a digest that identifies the output of serializing `obj`,
+        without serializing it, by hashing the model, primary key, and the
+        value of the `version_field` option, if set, of each object.  The
+        serializer's class, options and fields, and any options that would
+        be given to `encode`, are included too.
+
+        Querysets are only queried for those columns, so this is cheap
+        enough to decide whether to return a 304 Not Modified response.
+        Changes to objects that don't update their `version_field` are not
+        detected.
+        """
+        hasher = hashlib.new(algorithm)
+        hasher.update(self._describe_serializer())
+        hasher.update('\n%s:%s\n' % (format or '', _describe(sorted(opts.items()))))
+        version_field = self.opts.version_field
+
+        if hasattr(obj, 'all') and self._is_simple_callable(obj.all):
+            queryset = obj.all()
+            names = version_field and ('pk', version_field) or ('pk',)
+            label = smart_str(queryset.model._meta)
+            rows = ((label,) + row
+                    for row in queryset.values_list(*names).iterator())
+        else:
+            if not hasattr(obj, '__iter__'):
+                obj = [obj]
+            rows = ((smart_str(item._meta), item.pk) +
+                    (version_field and (getattr(item, version_field),) or ())
+                    for item in obj)
+
+        for row in rows:
+            hasher.update(':'.join([smart_str(value) for value in row]))
+            hasher.update('\n')
+        return hasher.hexdigest()
+
+    def _describe_serializer(self):
+        """
+        Return a description of the serializer's class, options and fields,
+        including those of any nested serializers.
+        """
+        cls = self.__class__
+        parts = [_describe(cls)]
+        for name, value in sorted(self.opts.__dict__.items()):
+            parts.append('%s=%s' % (name, _describe(value)))
+        for name, field in self.fields.items():
+            if isinstance(field, BaseSerializer):
+                description = '(%s)' % field._describe_serializer()
+            else:
+                description = _describe(field.__class__)
+                if 'serialize' in field.__dict__:
+                    description += ' serialize=%s' % _describe(field.serialize)
+            parts.append('%s=%s source=%r label=%r' % (
+                name, description, field.source, field.label))
+        return '; '.join(parts)
+
+    def encode_page(self, obj, format=None, cursor=None, page_size=50,
+                    ordering=None, **opts):
+        """
+        Serialize one page of a queryset, using keyset pagination.
+
+        Returns a tuple of `(page, next_cursor)`, where `next_cursor` is an
+        opaque token that may be passed back in to get the following page,
+        or `None` if this is the last page.  `ordering` defaults to the
+        queryset's ordering, and the primary key is always used to break ties.
+        """
+        queryset = self._get_queryset(obj)
+        ordering = get_keyset_ordering(queryset, ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            values = decode_cursor(queryset.model, ordering, cursor)
+            queryset = queryset.filter(keyset_filter(ordering, values))
+
+        # Fetch one extra object, to tell whether there's a following page.
+        items = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            next_cursor = encode_cursor(queryset.model, ordering, items[-1])
+        # Encoding the list loads the page's related objects in bulk.
+        return self.encode(items, format, **opts), next_cursor
+
+    def serialize_columns(self, obj, layout='columns', numpy_arrays=False):
+        if hasattr(obj, 'all') and self._is_simple_callable(obj.all):
+            obj = self._iter_prefetched(self._get_queryset(obj))
+        elif isinstance(obj, (list, tuple)):
+            obj = self._iter_prefetched(obj)
+        return super(ModelSerializer, self).serialize_columns(obj, layout,
+                                                              numpy_arrays)
 
 
 class DumpDataFields(ModelSerializer):
@@ -320,16 +1259,32 @@ class DumpDataSerializer(ModelSerializer):
     _use_sorted_dict = False
 
     renderer_classes = {
-        'xml': DumpDataXMLRenderer,
-        'json': JSONRenderer,
-        'yaml': YAMLRenderer,
+        'xml': 'serializers.renderers.DumpDataXMLRenderer',
+        'json': 'serializers.renderers.JSONRenderer',
+        'yaml': 'serializers.renderers.YAMLRenderer',
     }
 
     pk = Field()
     model = ModelNameField()
     fields = DumpDataFields(source='*')
 
+    class Meta(ModelSerializer.Meta):
+        cache_plans = True
+
+    def enable_natural_keys(self):
+        """
+        Serialize related fields using natural keys, rather than primary keys.
+        """
+        self.fields['fields'] = DumpDataFields(source='*', related_field=NaturalKeyRelatedField)
+        self._field_plans = None
+        self._compiled_plans = None
+
     def encode(self, obj, format=None, **opts):
         if opts.get('use_natural_keys', None):
-            self.fields['fields'] = DumpDataFields(source='*', related_field=NaturalKeyRelatedField)
+            self.enable_natural_keys()
         return super(DumpDataSerializer, self).encode(obj, format, **opts)
+
+    def encode_iter(self, obj, format, **opts):
+        if opts.get('use_natural_keys', None):
+            self.enable_natural_keys()
+        return super(DumpDataSerializer, self).encode_iter(obj, format, **opts)
@@ -0,0 +1,35 @@
+"""
+Test case helpers for checking the number of queries that serializers make.
+"""
+from serializers.queries import QueryTracker
+
+
+class QueryCountMixin(object):
+    """
+    A mixin for `TestCase` classes, with assertions that fail if a
+    serializer makes more queries than expected, listing the fields that
+    made repeated queries.
+    """
+    def assertSerializerQueries(self, num, serializer, obj, format=None, **opts):
+        """
+        Assert that encoding `obj` makes exactly `num` queries.
+        """
+        with QueryTracker() as tracker:
+            serializer.encode(obj, format, **opts)
+        if tracker.count != num:
+            self.fail("%s, %d expected" % (tracker.get_message(), num))
+
+    def assertQueriesIndependentOfSize(self, serializer, small, large,
+                                       format=None, **opts):
+        """
+        Assert that encoding the querysets `small` and `large` make the same
+        number of queries, so that serialization does not query once per object.
+        """
+        counts = []
+        for obj in (small, large):
+            with QueryTracker() as tracker:
+                serializer.encode(obj, format, **opts)
+            counts.append(tracker)
+        if counts[0].count != counts[1].count:
+            self.fail("Queries grow with the number of objects, from %d to %d.  %s" %
+                      (counts[0].count, counts[1].count, counts[1].get_message()))
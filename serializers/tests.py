@@ -1,9 +1,39 @@
+import bz2
 import datetime
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import StringIO
+import tempfile
 from django.core import serializers
+from django.core.management import call_command
 from django.db import models
-from django.test import TestCase
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+from django.utils import simplejson as json
 from serializers import Serializer, ModelSerializer, DumpDataSerializer
-from serializers.fields import Field, NaturalKeyRelatedField
+from serializers.deserializer import BulkDeserializer
+from serializers.dumpfiles import IndexedDumpReader, IndexedDumpWriter
+from serializers.exports import export
+from serializers import compiler, metrics
+from serializers.fields import (
+    CountField,
+    Field,
+    ModelField,
+    NaturalKeyRelatedField,
+    RelatedField,
+    SumField,
+    register_type,
+    unregister_type
+)
+from serializers.pagination import InvalidCursor
+from serializers.queries import QueryBudgetExceeded
+from serializers.renderers import DumpDataXMLRenderer, JSONRenderer
+from serializers.testing import QueryCountMixin
+from serializers.utils import LRUCache, camelcase
+from serializers.warmup import warm_up
 
 
 class ExampleObject(object):
@@ -362,6 +392,64 @@ class SerializerFieldTests(TestCase):
 
         self.assertEquals(CustomSerializer().serialize(self.obj), expected)
 
+    def test_key_transform(self):
+        """
+        Setting 'Meta.key_transform' applies a function to each key.
+        """
+        class CustomSerializer(Serializer):
+            class Meta:
+                fields = ('first_name', 'full_name', 'age')
+                key_transform = camelcase
+
+        expected = {
+            'firstName': 'john',
+            'fullName': 'john doe',
+            'age': 42
+        }
+
+        self.assertEquals(CustomSerializer().serialize(self.obj), expected)
+
+    def test_key_transform_applies_to_label(self):
+        class CustomSerializer(Serializer):
+            full_name = Field(label='full_name_label')
+
+        serializer = CustomSerializer(key_transform=lambda key: key.upper())
+        expected = {
+            'FULL_NAME_LABEL': 'john doe',
+        }
+
+        self.assertEquals(serializer.serialize(self.obj), expected)
+
+    def test_register_type(self):
+        """
+        `register_type` sets the function used to serialize a given type.
+        """
+        class Money(object):
+            def __init__(self, amount):
+                self.amount = amount
+
+        class CustomSerializer(Serializer):
+            balance = Field()
+            savings = Serializer()
+
+        self.obj.balance = Money(10)
+        self.obj.savings = Money(20)
+        register_type(Money, lambda money: '$%d' % money.amount)
+        try:
+            expected = {
+                'balance': '$10',
+                'savings': '$20'
+            }
+            self.assertEquals(CustomSerializer().serialize(self.obj), expected)
+        finally:
+            unregister_type(Money)
+
+        expected = {
+            'balance': unicode(self.obj.balance),
+            'savings': {'amount': 20}
+        }
+        self.assertEquals(CustomSerializer().serialize(self.obj), expected)
+
     # def test_serializer_fields_do_not_share_state(self):
     #     """
     #     Make sure that different serializer instances do not share the same
@@ -561,6 +649,148 @@ class TestSimpleModel(TestCase):
         )
 
 
+class TestColumnarOutput(TestCase):
+    def setUp(self):
+        self.serializer = ModelSerializer(depth=0)
+        RaceEntry.objects.create(
+            name='John doe',
+            runner_number=6014,
+            start_time=datetime.datetime(year=2012, month=4, day=30, hour=9),
+            finish_time=datetime.datetime(year=2012, month=4, day=30, hour=12, minute=25)
+        )
+        RaceEntry.objects.create(
+            name='Jane doe',
+            runner_number=6015,
+            start_time=datetime.datetime(year=2012, month=4, day=30, hour=9),
+            finish_time=datetime.datetime(year=2012, month=4, day=30, hour=11, minute=50)
+        )
+
+    def test_unsupported_format(self):
+        serializer = ModelSerializer()
+        self.assertRaises(ValueError, serializer.encode,
+                          RaceEntry.objects.all(), 'csv', columnar=True)
+        self.assertRaises(ValueError, DumpDataSerializer().encode,
+                          RaceEntry.objects.all(), 'xml', columnar='rows')
+
+    def test_columns(self):
+        serializer = ModelSerializer(fields=('id', 'name', 'runner_number'))
+        expected = {
+            'fields': ['id', 'name', 'runner_number'],
+            'columns': {
+                'id': [1, 2],
+                'name': [u'John doe', u'Jane doe'],
+                'runner_number': [6014, 6015]
+            }
+        }
+        self.assertEquals(
+            serializer.encode(RaceEntry.objects.all(), columnar=True),
+            expected
+        )
+
+    def test_rows_json(self):
+        serializer = ModelSerializer(fields=('id', 'name'))
+        expected = (
+            '{"fields": ["id", "name"], '
+            '"rows": [[1, "John doe"], [2, "Jane doe"]]}'
+        )
+        self.assertEquals(
+            serializer.encode(RaceEntry.objects.all(), 'json', columnar='rows'),
+            expected
+        )
+
+    def test_columns_yaml(self):
+        serializer = ModelSerializer(fields=('id', 'name'))
+        expected = (
+            'columns:\n'
+            '  id: [1, 2]\n'
+            '  name: [John doe, Jane doe]\n'
+            'fields: [id, name]\n'
+        )
+        self.assertEquals(
+            serializer.encode(RaceEntry.objects.all(), 'yaml', columnar=True),
+            expected
+        )
+
+    def test_heterogeneous_objects(self):
+        objs = [Person('john', 'doe', 42), ExampleObject()]
+        self.assertRaises(ValueError, Serializer().serialize_columns, objs)
+
+    def test_stack(self):
+        serializer = ModelSerializer(fields=('id', 'name'))
+        serializer.serialize_columns(RaceEntry.objects.all())
+        self.assertEquals(serializer.stack, [])
+
+
+class PerObjectKeySerializer(ModelSerializer):
+    def get_field_key(self, obj, field_name, field):
+        return '%s_%s' % (field_name, obj.pk)
+
+    class Meta:
+        fields = ('id',)
+
+
+class TestPlanCaching(TestCase):
+    """
+    Test that field plans are only cached per model when `cache_plans` is set.
+    """
+    def setUp(self):
+        for index in range(2):
+            Owner.objects.create(email='%d@example.com' % index)
+
+    def test_per_object_hooks(self):
+        data = PerObjectKeySerializer().serialize(Owner.objects.order_by('pk'))
+        self.assertEquals(data, [{'id_1': 1}, {'id_2': 2}])
+
+    def test_cache_plans(self):
+        serializer = PerObjectKeySerializer(cache_plans=True)
+        data = serializer.serialize(Owner.objects.order_by('pk'))
+        self.assertEquals(data, [{'id_1': 1}, {'id_1': 2}])
+
+
+class TestLazySerialization(TestCase):
+    def setUp(self):
+        self.serializer = ModelSerializer(fields=('id', 'name'))
+        for number in range(5):
+            RaceEntry.objects.create(
+                name='Runner %d' % number,
+                runner_number=number,
+                start_time=datetime.datetime(year=2012, month=4, day=30, hour=9),
+                finish_time=datetime.datetime(year=2012, month=4, day=30, hour=12)
+            )
+
+    def test_lazy_slice(self):
+        """
+        Slicing a lazy queryset is performed in the database.
+        """
+        lazy = self.serializer.serialize_lazy(RaceEntry.objects.all())
+        with self.assertNumQueries(1):
+            page = list(lazy[1:3])
+        self.assertEquals(page, [
+            {'id': 2, 'name': u'Runner 1'},
+            {'id': 3, 'name': u'Runner 2'}
+        ])
+
+    def test_lazy_index_cached(self):
+        lazy = self.serializer.serialize_lazy(RaceEntry.objects.all())
+        with self.assertNumQueries(1):
+            self.assertEquals(lazy[0], {'id': 1, 'name': u'Runner 0'})
+            self.assertEquals(lazy[0], {'id': 1, 'name': u'Runner 0'})
+
+    def test_lazy_equals_serialize(self):
+        lazy = self.serializer.serialize_lazy(RaceEntry.objects.all())
+        self.assertEquals(len(lazy), 5)
+        expected = ModelSerializer(fields=('id', 'name')).serialize(
+            RaceEntry.objects.all()
+        )
+        self.assertEquals(lazy, expected)
+
+    def test_lazy_iterator_stops_early(self):
+        people = (Person('john', 'doe', age) for age in range(100))
+        lazy = Serializer(fields=('age',)).serialize_lazy(people)
+        self.assertEquals(list(lazy[:2]), [{'age': 0}, {'age': 1}])
+        self.assertEquals(people.next().age, 2)
+
+
 ##### Model Inheritance #####
 
 class Account(models.Model):
@@ -699,6 +929,84 @@ class TestNaturalKey(TestCase):
         )
 
 
+class NameManager(models.Manager):
+    def get_by_natural_key(self, name):
+        return self.get(name=name)
+
+
+class Team(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    captain = models.ForeignKey('Player', null=True, related_name='captain_of')
+
+    objects = NameManager()
+
+    def natural_key(self):
+        return (self.name,)
+
+
+class Player(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    team = models.ForeignKey(Team, related_name='players')
+
+    objects = NameManager()
+
+    def natural_key(self):
+        return (self.name,)
+
+
+class TestBulkDeserializeNaturalKey(TestCase):
+    def setUp(self):
+        for team_index in range(3):
+            team = Team.objects.create(name='team %d' % team_index)
+            for index in range(3):
+                player = Player.objects.create(
+                    name='player %d-%d' % (team_index, index),
+                    team=team
+                )
+            team.captain = player
+            team.save()
+
+    def test_naturalkey_load(self):
+        data = DumpDataSerializer().encode(Player.objects.all(), 'json',
+                                           use_natural_keys=True)
+        Team.objects.update(captain=None)
+        Player.objects.all().delete()
+        # One query to find the natural key fields from the first key, one
+        # for the remaining keys, one to insert the players, and three to
+        # check their constraints.
+        with self.assertNumQueries(6):
+            self.assertEquals(BulkDeserializer().load(data, 'json'), 9)
+        self.assertEquals(Player.objects.get(name='player 1-2').team.name,
+                          u'team 1')
+
+    def test_circular_natural_keys(self):
+        objs = list(Team.objects.all()) + list(Player.objects.all())
+        data = DumpDataSerializer().encode(objs, 'json', use_natural_keys=True)
+        Team.objects.update(captain=None)
+        Player.objects.all().delete()
+        Team.objects.all().delete()
+        self.assertEquals(BulkDeserializer().load(data, 'json'), 12)
+        team = Team.objects.get(name='team 0')
+        self.assertEquals(team.captain.name, u'player 0-2')
+        self.assertEquals(team.captain.team, team)
+
+    def test_load_xml(self):
+        Team.objects.filter(name='team 1').update(captain=None)
+        objs = list(Team.objects.all()) + list(Player.objects.all())
+        expected = serializers.serialize('json', objs)
+        data = DumpDataSerializer().encode(objs, 'xml', use_natural_keys=True)
+        self.assertEquals(
+            data,
+            serializers.serialize('xml', objs, use_natural_keys=True)
+        )
+        Team.objects.update(captain=None)
+        Player.objects.all().delete()
+        Team.objects.all().delete()
+        self.assertEquals(BulkDeserializer().load(data, 'xml'), 12)
+        objs = list(Team.objects.all()) + list(Player.objects.all())
+        self.assertEquals(serializers.serialize('json', objs), expected)
+
+
 ##### One to one relationships #####
 
 class User(models.Model):
@@ -869,6 +1177,25 @@ class TestFKModel(TestCase):
             serializers.serialize('xml', Vehicle.objects.all())
         )
 
+    def test_fk_dumpdata_xml_escaping(self):
+        Vehicle.objects.create(
+            owner=Owner.objects.get(id=1),
+            licence=u'<A&B> "\xe9"',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        self.assertEquals(
+            self.dumpdata.encode(Vehicle.objects.all(), 'xml'),
+            serializers.serialize('xml', Vehicle.objects.all())
+        )
+
+    def test_fk_dumpdata_xml_layout(self):
+        renderer = DumpDataXMLRenderer()
+        data = self.dumpdata.serialize(Vehicle.objects.all())
+        renderer.render(data + self.dumpdata.serialize(Owner.objects.all()))
+        # The field order and attributes are found once per model.
+        self.assertEquals(sorted([key[0] for key in renderer.layouts]),
+                          [u'serializers.owner', u'serializers.vehicle'])
+
     def test_fk_nested(self):
         expected = {
             'id': 1,
@@ -933,6 +1260,1074 @@ class TestFKModel(TestCase):
         )
 
 
+class TestDottedSource(TestCase):
+    def setUp(self):
+        for email in ('tom@example.com', 'ann@example.com'):
+            owner = Owner.objects.create(email=email)
+            Vehicle.objects.create(
+                owner=owner,
+                licence='DJANGO42',
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+
+    def test_dotted_source(self):
+        class VehicleSerializer(ModelSerializer):
+            owner_email = Field(source='owner.email')
+
+            class Meta:
+                fields = ('licence', 'owner_email')
+
+        for compile in (False, True):
+            serializer = VehicleSerializer(compile=compile)
+            # The owners are fetched in the same query.
+            with self.assertNumQueries(1):
+                data = serializer.encode(Vehicle.objects.all(), 'csv')
+            self.assertEquals(data, 'licence,owner_email\r\n'
+                                    'DJANGO42,tom@example.com\r\n'
+                                    'DJANGO42,ann@example.com\r\n')
+
+    def test_dotted_model_field(self):
+        class VehicleSerializer(ModelSerializer):
+            owner_id = ModelField(source='owner.id')
+
+            class Meta:
+                fields = ('licence', 'owner_id')
+
+        with self.assertNumQueries(1):
+            data = VehicleSerializer().serialize(Vehicle.objects.all())
+        self.assertEquals(data[1], {'licence': 'DJANGO42', 'owner_id': 2})
+
+    def test_none_along_the_way(self):
+        class PersonSerializer(Serializer):
+            parent_name = Field(source='parent.full_name')
+
+            class Meta:
+                fields = ('first_name', 'parent_name')
+
+        parent = Person('john', 'doe', 42)
+        person = Person('jane', 'doe', 12, parent=parent)
+        self.assertEquals(PersonSerializer().serialize(person),
+                          {'first_name': 'jane', 'parent_name': 'john doe'})
+        person = Person('jane', 'doe', 12, parent=None)
+        self.assertEquals(PersonSerializer().serialize(person),
+                          {'first_name': 'jane', 'parent_name': None})
+
+
+class TestMemoize(TestCase):
+    def setUp(self):
+        self.calls = []
+        for email in ('tom@example.com', 'ann@example.com'):
+            owner = Owner.objects.create(email=email)
+            for licence in ('A1', 'B2', 'C3'):
+                Vehicle.objects.create(
+                    owner=owner,
+                    licence=licence,
+                    date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+                )
+
+    def get_serializer(self, **kwargs):
+        calls = self.calls
+
+        class OwnerNameField(Field):
+            def serialize(self, obj):
+                calls.append(obj)
+                return obj.email.split('@')[0]
+
+        class VehicleSerializer(ModelSerializer):
+            owner_name = OwnerNameField(source='owner',
+                                        memoize=lambda obj: obj.owner_id,
+                                        **kwargs)
+
+            class Meta:
+                fields = ('licence', 'owner_name')
+
+        return VehicleSerializer()
+
+    def test_memoize(self):
+        serializer = self.get_serializer()
+        data = serializer.serialize(Vehicle.objects.all())
+        self.assertEquals([item['owner_name'] for item in data],
+                          ['tom', 'tom', 'tom', 'ann', 'ann', 'ann'])
+        self.assertEquals(len(self.calls), 2)
+        self.assertEquals(serializer.get_memo_stats(), {
+            'owner_name': {'hits': 4, 'misses': 2, 'hit_rate': 4 / 6.0}
+        })
+
+    def test_memoize_per_encode(self):
+        serializer = self.get_serializer()
+        serializer.encode(Vehicle.objects.all(), 'json')
+        Owner.objects.filter(email='tom@example.com').update(email='tim@example.com')
+        data = json.loads(serializer.encode(Vehicle.objects.all(), 'json'))
+        self.assertEquals(data[0]['owner_name'], 'tim')
+        self.assertEquals(len(self.calls), 4)
+
+    def test_memoize_across_encodes(self):
+        serializer = self.get_serializer(memoize_size=1)
+        serializer.encode(Vehicle.objects.all(), 'json')
+        serializer.encode(Vehicle.objects.filter(owner__email='ann@example.com'), 'json')
+        # Only the most recently used output is kept.
+        self.assertEquals(len(self.calls), 2)
+        serializer.encode(Vehicle.objects.filter(owner__email='tom@example.com'), 'json')
+        self.assertEquals(len(self.calls), 3)
+
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a']
+        cache['c'] = 3
+        self.assertEquals((len(cache), 'a' in cache, 'b' in cache), (2, True, False))
+        cache['a'] = 4
+        cache['d'] = 5
+        self.assertEquals((cache['a'], 'c' in cache), (4, False))
+
+
+class TestPrefetchRelated(TestCase):
+    """
+    Test that reverse and many to many relationships are loaded in bulk.
+    """
+    def setUp(self):
+        for email in ('tom@example.com', 'ann@example.com', 'joe@example.com'):
+            owner = Owner.objects.create(email=email)
+            for licence in ('A1', 'B2'):
+                Vehicle.objects.create(
+                    owner=owner,
+                    licence=licence,
+                    date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+                )
+
+    def test_prefetch_flat(self):
+        serializer = ModelSerializer(include=('vehicles',), depth=0)
+        with self.assertNumQueries(2):
+            data = serializer.serialize(Owner.objects.all())
+        self.assertEquals(data[0]['vehicles'], [1, 2])
+        self.assertEquals(data[2]['vehicles'], [5, 6])
+
+    def test_prefetch_nested(self):
+        expected = ModelSerializer(include=('vehicles',), prefetch_chunk_size=None)
+        expected = expected.serialize(Owner.objects.all())
+        serializer = ModelSerializer(include=('vehicles',), prefetch_chunk_size=2)
+        # One query for the owners, and one per chunk for their vehicles.
+        with self.assertNumQueries(3):
+            data = list(serializer.serialize_iter(Owner.objects.all()))
+        self.assertEquals(data, expected)
+
+    def test_prefetch_list(self):
+        serializer = ModelSerializer(include=('vehicles',))
+        owners = list(Owner.objects.all())
+        with self.assertNumQueries(1):
+            data = serializer.serialize(owners)
+        self.assertEquals([vehicle['licence'] for vehicle in data[2]['vehicles']],
+                          [u'A1', u'B2'])
+        with self.assertNumQueries(1):
+            data = ''.join(serializer.encode_iter(owners, 'json'))
+        self.assertEquals(data, serializer.encode(Owner.objects.all(), 'json'))
+
+    def test_prefetch_mixed_list(self):
+        serializer = ModelSerializer()
+        objs = list(Vehicle.objects.all()) + list(Owner.objects.all()[:1])
+        # One query for the vehicles' owners.
+        with self.assertNumQueries(1):
+            data = serializer.serialize(objs)
+        self.assertEquals(data[5]['owner']['email'], u'joe@example.com')
+        self.assertEquals(data[6]['email'], u'tom@example.com')
+
+    def test_prefetch_hook(self):
+        class VehicleCountField(RelatedField):
+            def prefetch_related(self, objs, field_name):
+                counts = Vehicle.objects.filter(owner__in=objs) \
+                                        .values('owner').annotate(count=Count('id'))
+                self.counts = dict([(row['owner'], row['count']) for row in counts])
+
+            def serialize_field(self, obj, field_name):
+                return self.counts[obj.pk]
+
+        class OwnerSerializer(ModelSerializer):
+            vehicle_count = VehicleCountField()
+
+            class Meta:
+                fields = ('email', 'vehicle_count')
+
+        with self.assertNumQueries(2):
+            data = OwnerSerializer().serialize(Owner.objects.all())
+        self.assertEquals([item['vehicle_count'] for item in data], [2, 2, 2])
+
+
+class TestQueryBudget(QueryCountMixin, TestCase):
+    """
+    Test query budgets, and the query count assertions.
+    """
+    def setUp(self):
+        for email in ('tom@example.com', 'ann@example.com', 'joe@example.com'):
+            owner = Owner.objects.create(email=email)
+            Vehicle.objects.create(
+                owner=owner,
+                licence='DJANGO42',
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+
+    def test_budget_exceeded(self):
+        serializer = ModelSerializer(include=('vehicles',), depth=0,
+                                     prefetch_chunk_size=None)
+        try:
+            serializer.encode(Owner.objects.all(), 'json', max_queries=2)
+        except QueryBudgetExceeded, exc:
+            self.assertTrue('vehicles (x2)' in str(exc))
+        else:
+            self.fail('QueryBudgetExceeded not raised')
+
+    def test_budget_log(self):
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+
+        messages = []
+        handler = ListHandler()
+        logging.getLogger('serializers').addHandler(handler)
+        try:
+            serializer = ModelSerializer(include=('vehicles',), depth=0,
+                                         prefetch_chunk_size=None)
+            serializer.encode(Owner.objects.all(), 'json', max_queries=2,
+                              query_budget_action='log')
+        finally:
+            logging.getLogger('serializers').removeHandler(handler)
+        self.assertEquals(len(messages), 1)
+        self.assertTrue('vehicles (x' in messages[0])
+
+    def test_budget_within_limit(self):
+        serializer = ModelSerializer(include=('vehicles',), depth=0)
+        self.assertEquals(
+            serializer.encode(Owner.objects.all(), max_queries=2),
+            ModelSerializer(include=('vehicles',), depth=0).encode(Owner.objects.all())
+        )
+
+    def test_assert_queries(self):
+        serializer = ModelSerializer(include=('vehicles',), depth=0)
+        self.assertSerializerQueries(2, serializer, Owner.objects.all(), 'json')
+        self.assertQueriesIndependentOfSize(serializer, Owner.objects.all()[:1],
+                                            Owner.objects.all())
+
+    def test_assert_queries_fails(self):
+        serializer = ModelSerializer(include=('vehicles',), depth=0,
+                                     prefetch_chunk_size=None)
+        self.assertRaises(
+            AssertionError,
+            self.assertQueriesIndependentOfSize,
+            serializer, Owner.objects.all()[:1], Owner.objects.all()
+        )
+
+
+class TestCursorPagination(TestCase):
+    def setUp(self):
+        self.serializer = ModelSerializer(depth=0)
+        for index in range(5):
+            RaceEntry.objects.create(
+                name='runner %d' % index,
+                runner_number=index % 2,
+                start_time=datetime.datetime(2012, 4, 30, 9),
+                finish_time=datetime.datetime(2012, 4, 30, 12, index)
+            )
+
+    def get_pages(self, queryset, **kwargs):
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = self.serializer.encode_page(queryset, cursor=cursor,
+                                                       page_size=2, **kwargs)
+            pages.append([item['id'] for item in page])
+            if cursor is None:
+                return pages
+
+    def test_pages(self):
+        self.assertEquals(self.get_pages(RaceEntry.objects.all()),
+                          [[1, 2], [3, 4], [5]])
+
+    def test_pages_with_ordering(self):
+        self.assertEquals(
+            self.get_pages(RaceEntry.objects.all(),
+                           ordering=('runner_number', '-finish_time')),
+            [[5, 3], [1, 4], [2]]
+        )
+
+    def test_page_query(self):
+        page, cursor = self.serializer.encode_page(RaceEntry.objects.all(),
+                                                   page_size=2)
+        with self.assertNumQueries(1):
+            page, cursor = self.serializer.encode_page(RaceEntry.objects.all(),
+                                                       'json', cursor=cursor,
+                                                       page_size=2)
+        self.assertEquals(json.loads(page)[0]['name'], 'runner 2')
+
+    def test_invalid_cursor(self):
+        self.assertRaises(InvalidCursor, self.serializer.encode_page,
+                          RaceEntry.objects.all(), cursor='invalid')
+        page, cursor = self.serializer.encode_page(RaceEntry.objects.all(),
+                                                   page_size=2)
+        self.assertRaises(InvalidCursor, self.serializer.encode_page,
+                          RaceEntry.objects.all(), cursor=cursor,
+                          ordering=('name',))
+
+
+class TestStreamingOutput(TestCase):
+    """
+    Test that streamed output is identical to the usual rendered output.
+    """
+    def setUp(self):
+        self.dumpdata = DumpDataSerializer()
+        self.owner = Owner.objects.create(
+            email='tom@example.com'
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='DJANGO42',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='',
+            date_of_manufacture=datetime.date(day=8, month=8, year=1990)
+        )
+
+    def assertStreamEquals(self, serializer, obj, format, **opts):
+        expected = serializer.encode(obj, format, **opts)
+        output = ''.join(serializer.encode_iter(obj, format, **opts))
+        self.assertEquals(output, expected)
+
+    def test_stream_json(self):
+        self.assertStreamEquals(self.dumpdata, Vehicle.objects.all(), 'json')
+
+    def test_stream_json_indent(self):
+        self.assertStreamEquals(self.dumpdata, Vehicle.objects.all(), 'json',
+                                indent=4)
+
+    def test_stream_json_empty(self):
+        self.assertStreamEquals(self.dumpdata, Vehicle.objects.none(), 'json',
+                                indent=4)
+
+    def test_stream_yaml(self):
+        self.assertStreamEquals(self.dumpdata, Vehicle.objects.all(), 'yaml')
+
+    def test_stream_xml(self):
+        self.assertStreamEquals(self.dumpdata, Vehicle.objects.all(), 'xml')
+
+    def test_stream_csv(self):
+        serializer = ModelSerializer(depth=0)
+        self.assertStreamEquals(serializer, Vehicle.objects.all(), 'csv')
+
+    def test_stream_gzip(self):
+        expected = self.dumpdata.encode(Vehicle.objects.all(), 'json')
+        output = ''.join(self.dumpdata.encode_iter(Vehicle.objects.all(),
+                                                   'json', compress='gzip'))
+        stream = gzip.GzipFile(fileobj=StringIO.StringIO(output))
+        self.assertEquals(stream.read(), expected)
+
+    def test_stream_bz2(self):
+        expected = self.dumpdata.encode(Vehicle.objects.all(), 'json')
+        output = ''.join(self.dumpdata.encode_iter(Vehicle.objects.all(),
+                                                   'json', compress='bz2'))
+        self.assertEquals(bz2.decompress(output), expected)
+
+
+class TestCompiledSerializer(TestCase):
+    """
+    Test that compiled serializers give the same output as the usual ones.
+    """
+    def setUp(self):
+        self.owner = Owner.objects.create(
+            email='tom@example.com'
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='DJANGO42',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='',
+            date_of_manufacture=datetime.date(day=8, month=8, year=1990)
+        )
+
+    def test_compiled_dumpdata(self):
+        for format in ('json', 'yaml', 'xml'):
+            self.assertEquals(
+                DumpDataSerializer(compile=True).encode(Vehicle.objects.all(), format),
+                serializers.serialize(format, Vehicle.objects.all())
+            )
+
+    def test_compiled_flat(self):
+        self.assertEquals(
+            ModelSerializer(depth=0, compile=True).serialize(Vehicle.objects.all()),
+            ModelSerializer(depth=0).serialize(Vehicle.objects.all())
+        )
+
+    def test_compiled_nested(self):
+        serializer = ModelSerializer(include=('vehicles',), compile=True)
+        self.assertEquals(
+            serializer.serialize(Owner.objects.all()),
+            ModelSerializer(include=('vehicles',)).serialize(Owner.objects.all())
+        )
+
+    def test_compiled_custom_field(self):
+        class LicenceField(Field):
+            def serialize(self, obj):
+                return obj.lower()
+
+        class VehicleSerializer(ModelSerializer):
+            licence = LicenceField()
+            owner_email = Field(source='owner',
+                                serialize=lambda owner: owner.email)
+
+            class Meta:
+                compile = True
+
+        expected = [
+            {'licence': 'django42', 'owner_email': u'tom@example.com'},
+            {'licence': '', 'owner_email': u'tom@example.com'}
+        ]
+        self.assertEquals(
+            VehicleSerializer().serialize(Vehicle.objects.all()),
+            expected
+        )
+
+
+class TestDirectJSON(TestCase):
+    """
+    Test that writing json directly gives identical output to rendering
+    the serialized objects.
+    """
+    def setUp(self):
+        self.owner = Owner.objects.create(
+            email='tom@example.com'
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence=u'DJANGO\u2603',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='',
+            date_of_manufacture=datetime.date(day=8, month=8, year=1990)
+        )
+
+    def test_direct_dumpdata(self):
+        for opts in ({}, {'indent': 4}, {'indent': 2, 'sort_keys': True}):
+            for compile in (False, True):
+                serializer = DumpDataSerializer(direct_json=True, compile=compile)
+                self.assertEquals(
+                    serializer.encode(Vehicle.objects.all(), 'json', **opts),
+                    serializers.serialize('json', Vehicle.objects.all(), **opts)
+                )
+
+    def test_direct_nested(self):
+        for opts in ({}, {'indent': 4}, {'sort_keys': True}):
+            serializer = ModelSerializer(include=('vehicles',), direct_json=True)
+            self.assertEquals(
+                serializer.encode(Owner.objects.all(), 'json', **opts),
+                ModelSerializer(include=('vehicles',)).encode(Owner.objects.all(), 'json', **opts)
+            )
+
+    def test_direct_single_object(self):
+        serializer = ModelSerializer(depth=0, direct_json=True)
+        self.assertEquals(
+            serializer.encode(self.owner, 'json', indent=4),
+            ModelSerializer(depth=0).encode(self.owner, 'json', indent=4)
+        )
+
+    def test_direct_empty_list(self):
+        serializer = DumpDataSerializer(direct_json=True)
+        self.assertEquals(serializer.encode(Vehicle.objects.none(), 'json'), '[]')
+
+    def test_direct_encode_iter(self):
+        serializer = DumpDataSerializer(direct_json=True)
+        self.assertEquals(
+            ''.join(serializer.encode_iter(Vehicle.objects.all(), 'json', indent=4)),
+            serializers.serialize('json', Vehicle.objects.all(), indent=4)
+        )
+
+
+class TestDigest(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(email='tom@example.com')
+        for licence in ('DJANGO42', 'PYTHON27', 'SQL99'):
+            Vehicle.objects.create(
+                owner=owner,
+                licence=licence,
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+
+    def test_encode_digest(self):
+        serializer = DumpDataSerializer()
+        expected = serializer.encode(Vehicle.objects.all(), 'json', indent=4)
+        ret, digest = serializer.encode(Vehicle.objects.all(), 'json',
+                                        indent=4, digest='sha1')
+        self.assertEquals(ret, expected)
+        self.assertEquals(digest, hashlib.sha1(expected).hexdigest())
+
+    def test_encode_digest_columnar(self):
+        serializer = DumpDataSerializer()
+        expected = serializer.encode(Vehicle.objects.all(), 'json',
+                                     columnar=True)
+        ret, digest = serializer.encode(Vehicle.objects.all(), 'json',
+                                        columnar=True, digest='md5')
+        self.assertEquals(ret, expected)
+        self.assertEquals(digest, hashlib.md5(expected).hexdigest())
+
+    def test_digest_requires_format(self):
+        serializer = DumpDataSerializer()
+        self.assertRaises(ValueError, serializer.encode,
+                          Vehicle.objects.all(), digest='md5')
+        self.assertRaises(ValueError, serializer.encode_iter,
+                          Vehicle.objects.all(), None, digest='md5')
+
+    def test_encode_iter_columnar(self):
+        self.assertRaises(ValueError, DumpDataSerializer().encode_iter,
+                          Vehicle.objects.all(), 'json', columnar=True)
+
+    def test_encode_iter_digest(self):
+        chunks = DumpDataSerializer().encode_iter(Vehicle.objects.all(), 'xml',
+                                                  compress='gzip', digest='md5')
+        ret = ''.join(chunks)
+        self.assertEquals(chunks.hexdigest(), hashlib.md5(ret).hexdigest())
+
+    def test_fingerprint(self):
+        serializer = ModelSerializer(version_field='licence')
+        with self.assertNumQueries(1):
+            fingerprint = serializer.fingerprint(Vehicle.objects.all(), 'json')
+        self.assertEquals(
+            serializer.fingerprint(list(Vehicle.objects.all()), 'json'),
+            fingerprint
+        )
+        self.assertNotEquals(
+            serializer.fingerprint(Vehicle.objects.all(), 'xml'),
+            fingerprint
+        )
+
+        Vehicle.objects.filter(pk=2).update(licence='PYTHON3')
+        changed = serializer.fingerprint(Vehicle.objects.all(), 'json')
+        self.assertNotEquals(changed, fingerprint)
+
+        Vehicle.objects.filter(pk=3).delete()
+        self.assertNotEquals(
+            serializer.fingerprint(Vehicle.objects.all(), 'json'),
+            changed
+        )
+
+    def test_fingerprint_options(self):
+        fingerprint = ModelSerializer().fingerprint(Vehicle.objects.all(), 'json')
+        self.assertEquals(
+            ModelSerializer().fingerprint(Vehicle.objects.all(), 'json'),
+            fingerprint
+        )
+        for serializer in (ModelSerializer(fields=('licence',)),
+                           ModelSerializer(exclude=('licence',)),
+                           ModelSerializer(depth=0),
+                           DumpDataSerializer()):
+            self.assertNotEquals(
+                serializer.fingerprint(Vehicle.objects.all(), 'json'),
+                fingerprint
+            )
+        self.assertNotEquals(
+            DumpDataSerializer().fingerprint(Vehicle.objects.all(), 'json',
+                                             use_natural_keys=True),
+            DumpDataSerializer().fingerprint(Vehicle.objects.all(), 'json')
+        )
+
+    def test_fingerprint_class_module(self):
+        # Classes with the same name in different modules don't collide.
+        OtherSerializer = type('ModelSerializer', (ModelSerializer,),
+                               {'__module__': 'other.serializers'})
+        self.assertNotEquals(
+            OtherSerializer().fingerprint(Vehicle.objects.all(), 'json'),
+            ModelSerializer().fingerprint(Vehicle.objects.all(), 'json')
+        )
+
+    def test_fingerprint_without_version_field(self):
+        serializer = ModelSerializer()
+        fingerprint = serializer.fingerprint(Vehicle.objects.get(pk=1))
+        Vehicle.objects.filter(pk=1).update(licence='PYTHON3')
+        self.assertEquals(
+            serializer.fingerprint(Vehicle.objects.filter(pk=1)),
+            fingerprint
+        )
+
+
+class TestParallelRender(TestCase):
+    def setUp(self):
+        self.data = [
+            {'id': index, 'name': u'Item %d \xe9' % index,
+             'tags': ['a', 'b'], 'created': datetime.date(2012, 1, index % 28 + 1)}
+            for index in range(25)
+        ]
+
+    def assertSameOutput(self, serializer, data, format, **opts):
+        self.assertEquals(
+            serializer.render(data, format, workers=2, chunk_size=10, **opts),
+            serializer.render(data, format, **opts)
+        )
+
+    def test_render(self):
+        serializer = Serializer()
+        self.assertSameOutput(serializer, self.data, 'json')
+        self.assertSameOutput(serializer, self.data, 'json', indent=4)
+        self.assertSameOutput(serializer, self.data, 'yaml')
+        self.assertSameOutput(serializer, self.data, 'xml')
+        self.assertSameOutput(serializer, self.data, 'csv')
+
+    def test_render_dumpdata(self):
+        owner = Owner.objects.create(email='tom@example.com')
+        for index in range(12):
+            Vehicle.objects.create(
+                owner=owner,
+                licence='DJANGO%d' % index,
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+        serializer = DumpDataSerializer()
+        data = serializer.serialize(Vehicle.objects.all())
+        self.assertSameOutput(serializer, data, 'xml')
+        self.assertSameOutput(serializer, data, 'json')
+
+    def test_plain_values(self):
+        # Not split into chunks, as yaml renders lists of values in flow style.
+        self.assertSameOutput(Serializer(), range(25), 'yaml')
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        for email in ('tom@example.com', 'ann@example.com', 'joe@example.com'):
+            Owner.objects.create(email=email)
+        self.metrics = metrics.AggregatingMetrics()
+        self.previous = metrics.set_backend(self.metrics)
+
+    def tearDown(self):
+        metrics.set_backend(self.previous)
+
+    def get_summary(self, name):
+        for item in self.metrics.summary():
+            if item['name'] == name:
+                return item
+
+    def test_disabled_by_default(self):
+        self.assertFalse(self.previous.enabled)
+        metrics.set_backend(None)
+        ModelSerializer().encode(Owner.objects.all(), 'json')
+        self.assertEquals(self.metrics.summary(), [])
+
+    def test_encode(self):
+        serializer = ModelSerializer()
+        ret = serializer.encode(Owner.objects.all(), 'json', max_queries=1)
+        encode = self.get_summary('encode')
+        tags = {'serializer': 'ModelSerializer', 'format': 'json'}
+        self.assertEquals(encode['tags'], tags)
+        self.assertEquals(encode['count'], 1)
+        self.assertEquals(encode['objects']['max'], 3)
+        self.assertEquals(encode['bytes']['max'], len(ret))
+        self.assertEquals(encode['queries']['max'], 1)
+        self.assertEquals(self.get_summary('serialize')['objects']['max'], 3)
+        self.assertEquals(self.get_summary('render')['bytes']['max'], len(ret))
+
+    def test_encode_iter(self):
+        serializer = ModelSerializer()
+        ret = ''.join(serializer.encode_iter(Owner.objects.all(), 'yaml'))
+        encode = self.get_summary('encode')
+        self.assertEquals(encode['tags']['format'], 'yaml')
+        self.assertEquals(encode['bytes']['max'], len(ret))
+        self.assertEquals(encode['objects']['max'], 3)
+        self.assertEquals(encode['queries']['max'], 1)
+
+    def test_encode_iter_single_object(self):
+        serializer = ModelSerializer(depth=1)
+        vehicle = Vehicle.objects.create(owner=Owner.objects.get(pk=1),
+                                         licence='DJANGO42',
+                                         date_of_manufacture=datetime.date(2012, 1, 1))
+        vehicle = Vehicle.objects.get(pk=vehicle.pk)
+        ''.join(serializer.encode_iter(vehicle, 'json'))
+        encode = self.get_summary('encode')
+        self.assertEquals(encode['objects']['max'], 1)
+        # One query for the vehicle's owner.
+        self.assertEquals(encode['queries']['max'], 1)
+
+    def test_percentiles(self):
+        for duration in range(100, 0, -1):
+            self.metrics.record('render', {}, duration)
+        duration = self.get_summary('render')['duration']
+        self.assertEquals(duration['min'], 1)
+        self.assertEquals(duration['max'], 100)
+        self.assertEquals(duration['mean'], 50.5)
+        self.assertEquals((duration['p50'], duration['p90'], duration['p99']),
+                          (50, 90, 99))
+
+    def test_max_samples(self):
+        self.metrics.max_samples = 10
+        for duration in range(100):
+            self.metrics.record('render', {}, duration)
+        (count, samples), = self.metrics.groups.values()
+        self.assertEquals((count, len(samples)), (100, 10))
+
+
+class TestWarmUp(TestCase):
+    def test_warm_up_plans(self):
+        serializer = ModelSerializer(include=('vehicles',), compile=True)
+        warm_up([(serializer, Owner)])
+        self.assertTrue((Owner, None) in serializer._field_plans)
+        self.assertTrue((Owner, None) in serializer._compiled_plans)
+        vehicles = [field for (field_name, key, field)
+                    in serializer._field_plans[(Owner, None)]
+                    if field_name == 'vehicles'][0]
+        self.assertTrue((Vehicle, None) in vehicles._field_plans)
+
+    def test_warm_up_new_instances(self):
+        class OwnerSerializer(ModelSerializer):
+            key_calls = []
+
+            def get_field_key(self, obj, field_name, field):
+                self.key_calls.append(field_name)
+                return field_name
+
+            class Meta:
+                fields = ('id', 'email')
+                compile = True
+
+        warm_up([(OwnerSerializer(), Owner)])
+        self.assertEquals(OwnerSerializer.key_calls, ['id', 'email'])
+        compiled = len(compiler._compiled_code)
+
+        owner = Owner.objects.create(email='tom@example.com')
+        data = OwnerSerializer().encode(owner)
+        self.assertEquals(data, {'id': 1, 'email': 'tom@example.com'})
+        self.assertEquals(OwnerSerializer.key_calls, ['id', 'email'])
+        self.assertEquals(len(compiler._compiled_code), compiled)
+
+        # Instances created with other options have their own plans.
+        OwnerSerializer(fields=('email',)).encode(owner)
+        self.assertEquals(OwnerSerializer.key_calls, ['id', 'email', 'email'])
+
+    def test_warm_up_output(self):
+        owner = Owner.objects.create(email='tom@example.com')
+        Vehicle.objects.create(
+            owner=owner,
+            licence='DJANGO42',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        serializer = DumpDataSerializer()
+        warm_up([(serializer, Vehicle)])
+        self.assertEquals(
+            serializer.encode(Vehicle.objects.all(), 'json'),
+            serializers.serialize('json', Vehicle.objects.all())
+        )
+
+    def test_lazy_renderers(self):
+        serializer = DumpDataSerializer()
+        self.assertEquals(serializer.renderer_classes['json'],
+                          'serializers.renderers.JSONRenderer')
+        self.assertEquals(serializer.get_renderer_class('json'), JSONRenderer)
+
+
+class OwnerProxy(Owner):
+    class Meta:
+        proxy = True
+
+
+class UnmanagedOwner(models.Model):
+    email = models.EmailField()
+
+    class Meta:
+        managed = False
+        db_table = 'serializers_owner'
+
+
+class TestParallelDumpCommand(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        owner = Owner.objects.create(email='tom@example.com')
+        for licence in ('DJANGO42', 'PYTHON27', 'SQL99'):
+            Vehicle.objects.create(
+                owner=owner,
+                licence=licence,
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def dump(self, format, **opts):
+        merged = os.path.join(self.dir, 'merged.' + format)
+        call_command('paralleldump', 'serializers.Vehicle', 'serializers.Owner',
+                     format=format, workers=1, chunk_size=2,
+                     output_dir=self.dir, merge=merged, verbosity=0, **opts)
+        return open(merged).read()
+
+    def test_dump_json(self):
+        objects = list(Owner.objects.all()) + list(Vehicle.objects.all())
+        for indent in (None, 4):
+            self.assertEquals(
+                self.dump('json', indent=indent),
+                serializers.serialize('json', objects, indent=indent)
+            )
+        self.assertEquals(
+            open(os.path.join(self.dir, 'serializers.Vehicle.json')).read(),
+            serializers.serialize('json', Vehicle.objects.all(), indent=4)
+        )
+
+    def test_dump_yaml(self):
+        objects = list(Owner.objects.all()) + list(Vehicle.objects.all())
+        self.assertEquals(self.dump('yaml'), serializers.serialize('yaml', objects))
+
+    def test_skipped_models(self):
+        merged = os.path.join(self.dir, 'merged.json')
+        call_command('paralleldump', 'serializers.Owner', 'serializers.OwnerProxy',
+                     'serializers.UnmanagedOwner', workers=1, output_dir=self.dir,
+                     merge=merged, verbosity=0)
+        self.assertEquals(open(merged).read(),
+                          serializers.serialize('json', Owner.objects.all()))
+        self.assertEquals(sorted(os.listdir(self.dir)),
+                          ['merged.json', 'serializers.Owner.json'])
+
+    def test_merge_empty(self):
+        Vehicle.objects.all().delete()
+        self.assertEquals(
+            self.dump('json'),
+            serializers.serialize('json', Owner.objects.all())
+        )
+
+
+class TestParallelDumpWorkers(TransactionTestCase):
+    """
+    Test dumping in several worker processes, from a file based database
+    that the workers can share.
+    """
+    multi_db = True
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        owner = Owner.objects.using('files').create(email='tom@example.com')
+        for licence in ('DJANGO42', 'PYTHON27', 'SQL99'):
+            Vehicle.objects.using('files').create(
+                owner=owner,
+                licence=licence,
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_dump_workers(self):
+        merged = os.path.join(self.dir, 'merged.json')
+        call_command('paralleldump', 'serializers.Vehicle', 'serializers.Owner',
+                     workers=2, chunk_size=2, database='files',
+                     output_dir=self.dir, merge=merged, verbosity=0)
+        objects = (list(Owner.objects.using('files').all()) +
+                   list(Vehicle.objects.using('files').all()))
+        self.assertEquals(open(merged).read(),
+                          serializers.serialize('json', objects))
+        # The command's own connection is still usable.
+        self.assertEquals(Vehicle.objects.using('files').count(), 3)
+
+
+class InterruptedSerializer(DumpDataSerializer):
+    """
+    Fails when it reaches the object with the given pk, as if the process
+    had been killed part way through an export.
+    """
+    def __init__(self, fail_on=None, **kwargs):
+        super(InterruptedSerializer, self).__init__(**kwargs)
+        self.fail_on = fail_on
+
+    def _serialize_item(self, item):
+        if item.pk == self.fail_on:
+            raise RuntimeError('Interrupted')
+        return super(InterruptedSerializer, self)._serialize_item(item)
+
+
+class TestResumableExport(TestCase):
+    def setUp(self):
+        owner = Owner.objects.create(email='tom@example.com')
+        for licence in ('DJANGO42', 'PYTHON27', 'SQL99', 'C89', 'HTML5'):
+            Vehicle.objects.create(
+                owner=owner,
+                licence=licence,
+                date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+            )
+        self.path = tempfile.mktemp()
+
+    def tearDown(self):
+        for path in (self.path, self.path + '.checkpoint'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def export(self, format, fail_on=None, resume=False, **opts):
+        return export(InterruptedSerializer(fail_on), Vehicle.objects.all(),
+                      self.path, format, chunk_size=2, resume=resume, **opts)
+
+    def assertResumes(self, format, **opts):
+        self.assertEquals(self.export(format, **opts), 5)
+        expected = open(self.path).read()
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+        self.assertRaises(RuntimeError, self.export, format, fail_on=4, **opts)
+        checkpoint = json.load(open(self.path + '.checkpoint'))
+        self.assertEquals((checkpoint['pk'], checkpoint['count']), ('2', 2))
+        self.assertEquals(self.export(format, resume=True, **opts), 5)
+        self.assertEquals(open(self.path).read(), expected)
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_resume_json(self):
+        self.assertResumes('json')
+        self.assertResumes('json', indent=4)
+        self.assertEquals(
+            open(self.path).read(),
+            serializers.serialize('json', Vehicle.objects.all(), indent=4)
+        )
+
+    def test_resume_yaml(self):
+        self.assertResumes('yaml')
+
+    def test_resume_xml(self):
+        self.assertResumes('xml')
+
+    def test_resume_without_checkpoint(self):
+        self.assertRaises(RuntimeError, self.export, 'json', fail_on=1)
+        self.assertEquals(self.export('json', resume=True), 5)
+        self.assertEquals(
+            open(self.path).read(),
+            serializers.serialize('json', Vehicle.objects.all())
+        )
+
+    def test_resume_after_last_chunk(self):
+        # Interrupted after the last checkpoint, with no objects left.
+        self.assertRaises(RuntimeError, self.export, 'json', fail_on=5)
+        Vehicle.objects.filter(pk=5).delete()
+        self.assertEquals(self.export('json', resume=True), 4)
+        self.assertEquals(
+            open(self.path).read(),
+            serializers.serialize('json', Vehicle.objects.all())
+        )
+
+
+class TestIndexedDumpFiles(TestCase):
+    def setUp(self):
+        self.owner = Owner.objects.create(
+            email='tom@example.com'
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='DJANGO42',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='',
+            date_of_manufacture=datetime.date(day=8, month=8, year=1990)
+        )
+        self.path = tempfile.mktemp()
+        with IndexedDumpWriter(self.path) as writer:
+            writer.write(Owner.objects.all())
+            writer.write(Vehicle.objects.all())
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.path + '.idx')
+
+    def test_get(self):
+        expected = json.loads(
+            DumpDataSerializer().encode(Vehicle.objects.get(id=2), 'json')
+        )
+        with IndexedDumpReader(self.path) as reader:
+            self.assertEquals(len(reader), 3)
+            self.assertEquals(reader.get(Vehicle, 2), expected)
+            self.assertEquals(reader.get('serializers.vehicle', 2), expected)
+
+    def test_missing_object(self):
+        with IndexedDumpReader(self.path) as reader:
+            self.assertFalse((Owner, 2) in reader)
+            self.assertRaises(KeyError, reader.get, Owner, 2)
+
+    def test_deserialize(self):
+        Vehicle.objects.all().delete()
+        with IndexedDumpReader(self.path) as reader:
+            for obj in reader.deserialize([(Vehicle, 1)]):
+                obj.save()
+        self.assertEquals(
+            list(Vehicle.objects.values_list('licence', flat=True)),
+            [u'DJANGO42']
+        )
+
+    def test_write_instance_twice(self):
+        vehicle = Vehicle.objects.get(id=1)
+        with IndexedDumpWriter(self.path) as writer:
+            writer.write(vehicle)
+            writer.write(vehicle)
+        with IndexedDumpReader(self.path) as reader:
+            self.assertEquals(reader.get(Vehicle, 1)['fields']['licence'],
+                              'DJANGO42')
+
+
+class Holiday(models.Model):
+    date = models.DateField(primary_key=True)
+    name = models.CharField(max_length=100)
+
+
+class TestIndexedDumpDatePrimaryKey(TestCase):
+    def setUp(self):
+        Holiday.objects.create(date=datetime.date(2012, 12, 25),
+                               name='Christmas')
+        self.path = tempfile.mktemp()
+        with IndexedDumpWriter(self.path) as writer:
+            writer.write(Holiday.objects.all())
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.remove(self.path + '.idx')
+
+    def test_get(self):
+        with IndexedDumpReader(self.path) as reader:
+            self.assertTrue((Holiday, datetime.date(2012, 12, 25)) in reader)
+            record = reader.get(Holiday, datetime.date(2012, 12, 25))
+            self.assertEquals(record['fields']['name'], 'Christmas')
+            self.assertEquals(reader.get(Holiday, '2012-12-25'), record)
+
+
+class TestBulkDeserializer(TestCase):
+    def setUp(self):
+        self.dumpdata = DumpDataSerializer()
+        self.owner = Owner.objects.create(
+            email='tom@example.com'
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='DJANGO42',
+            date_of_manufacture=datetime.date(day=6, month=6, year=2005)
+        )
+        Vehicle.objects.create(
+            owner=self.owner,
+            licence='',
+            date_of_manufacture=datetime.date(day=8, month=8, year=1990)
+        )
+
+    def assertLoadEquals(self, format, batch_size=1000):
+        expected = serializers.serialize('json', Vehicle.objects.all())
+        data = self.dumpdata.encode(Vehicle.objects.all(), format)
+        Vehicle.objects.all().delete()
+        deserializer = BulkDeserializer(batch_size=batch_size)
+        self.assertEquals(deserializer.load(data, format), 2)
+        self.assertEquals(
+            serializers.serialize('json', Vehicle.objects.all()),
+            expected
+        )
+
+    def test_load_json(self):
+        self.assertLoadEquals('json')
+
+    def test_load_json_in_batches(self):
+        self.assertLoadEquals('json', batch_size=1)
+
+    def test_load_yaml(self):
+        self.assertLoadEquals('yaml')
+
+    def test_load_xml(self):
+        self.assertLoadEquals('xml')
+
+
 class Author(models.Model):
     name = models.CharField(max_length=100)
 
@@ -981,6 +2376,28 @@ class TestManyToManyModel(TestCase):
             serializers.serialize('json', Author.objects.all())
         )
 
+    def test_m2m_recursive_outputs(self):
+        """
+        Each item of a list is serialized independently, so the output is
+        the same whichever way it is encoded.
+        """
+        serializer = ModelSerializer(include=('books',))
+        expected = serializer.encode(Author.objects.all(), 'json')
+        data = json.loads(expected)
+        # Only Mark, who is being serialized, is a recursion, rather than
+        # Lucy, who was serialized earlier in the list.
+        self.assertEquals(data[1]['books'][0]['authors'],
+                          [{'id': 1, 'name': 'Lucy Black'}, [1, 2]])
+        self.assertEquals(serializer.encode(list(Author.objects.all()), 'json'),
+                          expected)
+        self.assertEquals(
+            ''.join(serializer.encode_iter(Author.objects.all(), 'json')),
+            expected
+        )
+        serializer = ModelSerializer(include=('books',), direct_json=True)
+        self.assertEquals(serializer.encode(Author.objects.all(), 'json'),
+                          expected)
+
     def test_m2m_dumpdata_yaml(self):
         self.assertEquals(
             self.dumpdata.encode(Book.objects.all(), 'yaml'),
@@ -991,19 +2408,15 @@ class TestManyToManyModel(TestCase):
             serializers.serialize('yaml', Author.objects.all())
         )
 
-    # TODO
-    # def test_m2m_dumpdata_xml(self):
-    #     # # Hack to ensure field ordering is correct for xml
-    #     # dumpdata = DumpDataSerializer()
-    #     # dumpdata.fields['fields'].opts.preserve_field_order = True
-    #     self.assertEquals(
-    #         self.dumpdata.encode(Book.objects.all(), 'xml'),
-    #         serializers.serialize('xml', Book.objects.all())
-    #     )
-    #     self.assertEquals(
-    #         self.dumpdata.encode(Author.objects.all(), 'xml'),
-    #         serializers.serialize('xml', Author.objects.all())
-    #     )
+    def test_m2m_dumpdata_xml(self):
+        self.assertEquals(
+            self.dumpdata.encode(Book.objects.all(), 'xml'),
+            serializers.serialize('xml', Book.objects.all())
+        )
+        self.assertEquals(
+            self.dumpdata.encode(Author.objects.all(), 'xml'),
+            serializers.serialize('xml', Author.objects.all())
+        )
 
     def test_m2m_nested(self):
         expected = {
@@ -1031,3 +2444,321 @@ class TestManyToManyModel(TestCase):
             self.flat_model.serialize(Book.objects.get(id=1)),
             expected
         )
+
+    def assertLoadEquals(self, format):
+        expected = serializers.serialize('json', Book.objects.all())
+        data = self.dumpdata.encode(Book.objects.all(), format)
+        Book.objects.all().delete()
+        self.assertEquals(BulkDeserializer().load(data, format), 2)
+        self.assertEquals(
+            serializers.serialize('json', Book.objects.all()),
+            expected
+        )
+
+    def test_m2m_load(self):
+        self.assertLoadEquals('json')
+
+    def test_m2m_load_xml(self):
+        self.assertLoadEquals('xml')
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+
+    def natural_key(self):
+        return (self.name,)
+
+    class Meta:
+        ordering = ('name',)
+
+
+class Article(models.Model):
+    title = models.CharField(max_length=100)
+    tags = models.ManyToManyField(Tag, related_name='articles')
+    featured_tags = models.ManyToManyField(Tag, related_name='featured_articles')
+
+
+class TestManyToManyPrefetch(TestCase):
+    """
+    Test that many to many fields are loaded from their through tables in bulk.
+    """
+    def setUp(self):
+        tags = [Tag.objects.create(name=name)
+                for name in ('python', 'django', 'sql', 'xml')]
+        for index in range(5):
+            article = Article.objects.create(title='Article %d' % index)
+            article.tags = tags[index % 4:]
+            article.featured_tags = tags[:index % 3]
+
+    def test_dumpdata(self):
+        serializer = DumpDataSerializer()
+        # One query for the articles, and one for each through table.
+        with self.assertNumQueries(3):
+            data = serializer.encode(Article.objects.all(), 'json')
+        self.assertEquals(data, serializers.serialize('json', Article.objects.all()))
+
+    def test_dumpdata_natural_keys(self):
+        serializer = DumpDataSerializer()
+        # As above, plus one query for each field's tags.
+        with self.assertNumQueries(5):
+            data = serializer.encode(Article.objects.all(), 'json',
+                                     use_natural_keys=True)
+        self.assertEquals(
+            data,
+            serializers.serialize('json', Article.objects.all(),
+                                  use_natural_keys=True)
+        )
+
+    def test_chunks(self):
+        serializer = DumpDataSerializer(prefetch_chunk_size=2)
+        with self.assertNumQueries(7):
+            data = list(serializer.serialize_iter(Article.objects.all()))
+        self.assertEquals(data[4]['fields']['tags'], [2, 1, 3, 4])
+        self.assertEquals(data[4]['fields']['featured_tags'], [1])
+
+    def test_encode_page(self):
+        serializer = DumpDataSerializer()
+        # One query for the page, and one for each through table.
+        with self.assertNumQueries(3):
+            page, cursor = serializer.encode_page(Article.objects.all(), 'json',
+                                                  page_size=3)
+        self.assertEquals(
+            page,
+            serializers.serialize('json', Article.objects.order_by('pk')[:3])
+        )
+
+    def test_primary_keys_then_natural_keys(self):
+        articles = list(Article.objects.all())
+        DumpDataSerializer().encode(articles, 'json')
+        data = DumpDataSerializer().encode(articles[0], 'json',
+                                           use_natural_keys=True)
+        self.assertEquals(
+            data,
+            serializers.serialize('json', [articles[0]], use_natural_keys=True)[1:-1]
+        )
+
+    def test_changes_between_encodes(self):
+        articles = list(Article.objects.all())
+        serializer = DumpDataSerializer()
+        serializer.encode(articles, 'json')
+        articles[3].tags.add(Tag.objects.get(name='python'))
+        data = serializer.serialize(articles[3])
+        self.assertEquals(data['fields']['tags'], [1, 4])
+        data = DumpDataSerializer().serialize(articles[3])
+        self.assertEquals(data['fields']['tags'], [1, 4])
+
+
+class OwnerEmailField(RelatedField):
+    """
+    Loads each vehicle's owner email in batches, counting the batches.
+    """
+    batches = []
+
+    def collect(self, obj):
+        return obj.owner_id
+
+    def load_many(self, keys):
+        self.batches.append(sorted(keys))
+        return dict(Owner.objects.filter(pk__in=keys).values_list('pk', 'email'))
+
+
+class VehicleOwnerSerializer(ModelSerializer):
+    owner_email = OwnerEmailField()
+
+    class Meta:
+        fields = ('licence', 'owner_email')
+
+
+class TestBatchLoading(TestCase):
+    """
+    Test related fields that load their data in batches with `load_many`.
+    """
+    def setUp(self):
+        OwnerEmailField.batches = []
+        owners = [Owner.objects.create(email='%d@example.com' % index)
+                  for index in range(3)]
+        for index in range(5):
+            Vehicle.objects.create(owner=owners[index % 3],
+                                   licence='L%d' % index,
+                                   date_of_manufacture=datetime.date(2012, 1, 1))
+
+    def test_batch(self):
+        serializer = VehicleOwnerSerializer()
+        # One query for the vehicles, and one for the owners.
+        with self.assertNumQueries(2):
+            data = serializer.serialize(Vehicle.objects.all())
+        self.assertEquals([item['owner_email'] for item in data], [
+            '0@example.com', '1@example.com', '2@example.com',
+            '0@example.com', '1@example.com'
+        ])
+        self.assertEquals(OwnerEmailField.batches, [[1, 2, 3]])
+
+    def test_chunks(self):
+        serializer = VehicleOwnerSerializer(prefetch_chunk_size=2)
+        data = list(serializer.serialize_iter(Vehicle.objects.all()))
+        self.assertEquals(data[4]['owner_email'], '1@example.com')
+        self.assertEquals(OwnerEmailField.batches, [[1, 2], [1, 3], [2]])
+
+    def test_single_object(self):
+        serializer = VehicleOwnerSerializer()
+        data = serializer.serialize(Vehicle.objects.get(licence='L2'))
+        self.assertEquals(data['owner_email'], '2@example.com')
+        self.assertEquals(OwnerEmailField.batches, [[3]])
+
+    def test_batch_per_encode(self):
+        serializer = VehicleOwnerSerializer()
+        serializer.encode(Vehicle.objects.all(), 'json')
+        Owner.objects.filter(pk=3).update(email='changed@example.com')
+        data = serializer.encode(Vehicle.objects.get(licence='L2'))
+        self.assertEquals(data['owner_email'], 'changed@example.com')
+        self.assertEquals(OwnerEmailField.batches, [[1, 2, 3], [3]])
+
+
+class OwnerCountSerializer(ModelSerializer):
+    vehicle_count = CountField('vehicles')
+
+    class Meta:
+        fields = ('email', 'vehicle_count')
+
+
+class TestAggregateFields(TestCase):
+    """
+    Test aggregate fields, loaded with one grouped query per chunk.
+    """
+    def setUp(self):
+        for index in range(3):
+            owner = Owner.objects.create(email='%d@example.com' % index)
+            for vehicle in range(index):
+                Vehicle.objects.create(owner=owner, licence='L%d' % vehicle,
+                                       date_of_manufacture=datetime.date(2012, 1, 1))
+
+    def test_count(self):
+        serializer = OwnerCountSerializer()
+        # One query for the owners, and one for their counts.
+        with self.assertNumQueries(2):
+            data = serializer.serialize(Owner.objects.order_by('pk'))
+        self.assertEquals([item['vehicle_count'] for item in data], [0, 1, 2])
+
+    def test_encode_iter(self):
+        serializer = OwnerCountSerializer()
+        with self.assertNumQueries(2):
+            data = ''.join(serializer.encode_iter(Owner.objects.order_by('pk'), 'json'))
+        self.assertEquals(json.loads(data)[2]['vehicle_count'], 2)
+
+    def test_list(self):
+        serializer = OwnerCountSerializer()
+        owners = list(Owner.objects.order_by('pk'))
+        with self.assertNumQueries(1):
+            data = serializer.serialize(owners)
+        self.assertEquals([item['vehicle_count'] for item in data], [0, 1, 2])
+
+    def test_filtered_across_relationship(self):
+        # The queryset's own join isn't reused, and its rows are unchanged.
+        serializer = OwnerCountSerializer()
+        owners = Owner.objects.filter(vehicles__licence='L0').order_by('pk')
+        Vehicle.objects.create(owner=owners[1], licence='L0',
+                               date_of_manufacture=datetime.date(2012, 1, 1))
+        data = serializer.serialize(owners)
+        self.assertEquals([item['email'] for item in data], [
+            '1@example.com', '2@example.com', '2@example.com'
+        ])
+        self.assertEquals([item['vehicle_count'] for item in data], [1, 3, 3])
+
+    def test_changes_between_encodes(self):
+        serializer = OwnerCountSerializer()
+        owners = list(Owner.objects.order_by('pk'))
+        serializer.encode(owners, 'json')
+        Vehicle.objects.create(owner=owners[0], licence='L0',
+                               date_of_manufacture=datetime.date(2012, 1, 1))
+        self.assertEquals(serializer.encode(owners[0])['vehicle_count'], 1)
+
+    def test_single_object(self):
+        serializer = OwnerCountSerializer()
+        owner = Owner.objects.get(email='1@example.com')
+        self.assertEquals(serializer.serialize(owner)['vehicle_count'], 1)
+
+    def test_sum(self):
+        class OwnerSumSerializer(ModelSerializer):
+            vehicle_ids = SumField('vehicles__id')
+
+            class Meta:
+                fields = ('vehicle_ids',)
+
+        data = OwnerSumSerializer().serialize(Owner.objects.order_by('pk'))
+        self.assertEquals([item['vehicle_ids'] for item in data], [None, 1, 5])
+
+
+class OwnerLimitedSerializer(ModelSerializer):
+    vehicles = ModelSerializer(max_items=2, fields=('licence',))
+    vehicle_count = CountField('vehicles')
+
+    class Meta:
+        fields = ('email', 'vehicles', 'vehicle_count')
+
+
+class ArticleLimitedSerializer(ModelSerializer):
+    tags = ModelSerializer(max_items=2, fields=('name',))
+
+    class Meta:
+        fields = ('title', 'tags')
+
+
+class TestLimitedNestedItems(TestCase):
+    """
+    Test limiting nested collections to `max_items` objects per parent.
+    """
+    def setUp(self):
+        for index in range(3):
+            owner = Owner.objects.create(email='%d@example.com' % index)
+            for vehicle in range(index * 2):
+                Vehicle.objects.create(owner=owner,
+                                       licence='%d-%d' % (index, vehicle),
+                                       date_of_manufacture=datetime.date(2012, 1, 1))
+        tags = [Tag.objects.create(name=name)
+                for name in ('python', 'django', 'sql', 'xml')]
+        for index in range(3):
+            article = Article.objects.create(title='Article %d' % index)
+            article.tags = tags[index:]
+
+    def test_reverse_foreign_key(self):
+        serializer = OwnerLimitedSerializer()
+        # One query for the owners, one for the limited vehicle ids, one for
+        # the vehicles, and one for the vehicle counts.
+        with self.assertNumQueries(4):
+            data = serializer.serialize(Owner.objects.order_by('pk'))
+        self.assertEquals(
+            [[item['licence'] for item in owner['vehicles']] for owner in data],
+            [[], ['1-0', '1-1'], ['2-0', '2-1']]
+        )
+        self.assertEquals([owner['vehicle_count'] for owner in data], [0, 2, 4])
+
+    def test_many_to_many(self):
+        serializer = ArticleLimitedSerializer()
+        with self.assertNumQueries(3):
+            data = serializer.serialize(Article.objects.order_by('pk'))
+        # Tags are ordered by name.
+        self.assertEquals(
+            [[item['name'] for item in article['tags']] for article in data],
+            [['django', 'python'], ['django', 'sql'], ['sql', 'xml']]
+        )
+
+    def test_batches(self):
+        serializer = OwnerLimitedSerializer(prefetch_chunk_size=2)
+        data = serializer.serialize(Owner.objects.order_by('pk'))
+        self.assertEquals([len(owner['vehicles']) for owner in data], [0, 2, 2])
+
+    def test_single_object(self):
+        serializer = OwnerLimitedSerializer()
+        owner = Owner.objects.get(email='2@example.com')
+        data = serializer.serialize(owner)
+        self.assertEquals([item['licence'] for item in data['vehicles']],
+                          ['2-0', '2-1'])
+
+    def test_changes_between_encodes(self):
+        serializer = OwnerLimitedSerializer()
+        owners = list(Owner.objects.order_by('pk'))
+        serializer.encode(owners, 'json')
+        Vehicle.objects.filter(licence='2-0').delete()
+        data = serializer.encode(owners[2])
+        self.assertEquals([item['licence'] for item in data['vehicles']],
+                          ['2-1', '2-2'])
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from django.utils.datastructures import SortedDict
+import bz2
 import csv
+import hashlib
+import re
+import zlib
 
 
 class DictWithMetadata(dict):
@@ -24,50 +28,164 @@ class SortedDictWithMetadata(SortedDict, DictWithMetadata):
     pass
 
 
-try:
-    import yaml
-except ImportError:
-    SafeDumper = None
-else:
-    # Adapted from http://pyyaml.org/attachment/ticket/161/use_ordered_dict.py
-    class SafeDumper(yaml.SafeDumper):
+def camelcase(key):
+    """
+    Convert an underscored key into javascript style camel case.
+    Eg. 'first_name' becomes 'firstName'.
+    """
+    return re.sub('_([a-z])', lambda match: match.group(1).upper(), key)
+
+
+class LRUCache(object):
+    """
+    A mapping that holds at most `max_size` items, discarding the least
+    recently used item when it is full.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        # A circular doubly linked list of `[prev, next, key, value]` links,
+        # from least to most recently used.
+        self.root = root = []
+        root[:] = [root, root, None, None]
+        self.links = {}
+
+    def __len__(self):
+        return len(self.links)
+
+    def __contains__(self, key):
+        return key in self.links
+
+    def __getitem__(self, key):
+        link = self.links[key]
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+        self._append(link)
+        return link[3]
+
+    def __setitem__(self, key, value):
+        link = self.links.get(key)
+        if link is not None:
+            link[3] = value
+            self[key]
+            return
+        if len(self.links) >= self.max_size:
+            oldest = self.root[1]
+            self.root[1] = oldest[1]
+            oldest[1][0] = self.root
+            del self.links[oldest[2]]
+        link = [None, None, key, value]
+        self._append(link)
+        self.links[key] = link
+
+    def _append(self, link):
+        root = self.root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+
+def _is_queryset(obj):
+    return hasattr(obj, 'query') and hasattr(obj, 'iterator')
+
+
+class LazySerializedList(object):
+    """
+    A read-only sequence over a source iterable or queryset, that serializes
+    each item only as it is accessed, and caches the results.
+
+    Slicing returns a new `LazySerializedList` over the sliced source, so that
+    slicing a queryset is performed in the database using LIMIT/OFFSET.
+    """
+    def __init__(self, source, serialize):
+        if hasattr(source, '__getitem__'):
+            self._source = source
+            self._iterator = None
+        else:
+            self._source = []
+            self._iterator = iter(source)
+        self._serialize = serialize
+        self._cache = {}
+
+    def _fill(self, index=None):
         """
-        Handles decimals as strings.
-        Handles SortedDicts as usual dicts, but preserves field order, rather
-        than the usual behaviour of sorting the keys.
+        Read items from an iterator source, until the item at `index` is
+        available, or until the iterator is exhausted if `index` is `None`.
         """
-        def represent_decimal(self, data):
-            return self.represent_scalar('tag:yaml.org,2002:str', str(data))
-
-        def represent_mapping(self, tag, mapping, flow_style=None):
-            value = []
-            node = yaml.MappingNode(tag, value, flow_style=flow_style)
-            if self.alias_key is not None:
-                self.represented_objects[self.alias_key] = node
-            best_style = True
-            if hasattr(mapping, 'items'):
-                mapping = list(mapping.items())
-                if not isinstance(mapping, SortedDict):
-                    mapping.sort()
-            for item_key, item_value in mapping:
-                node_key = self.represent_data(item_key)
-                node_value = self.represent_data(item_value)
-                if not (isinstance(node_key, yaml.ScalarNode) and not node_key.style):
-                    best_style = False
-                if not (isinstance(node_value, yaml.ScalarNode) and not node_value.style):
-                    best_style = False
-                value.append((node_key, node_value))
-            if flow_style is None:
-                if self.default_flow_style is not None:
-                    node.flow_style = self.default_flow_style
-                else:
-                    node.flow_style = best_style
-            return node
-
-    SafeDumper.add_representer(DictWithMetadata,
-            yaml.representer.SafeRepresenter.represent_dict)
-    SafeDumper.add_representer(SortedDictWithMetadata,
-            yaml.representer.SafeRepresenter.represent_dict)
+        if self._iterator is None:
+            return
+        while index is None or len(self._source) <= index:
+            try:
+                self._source.append(self._iterator.next())
+            except StopIteration:
+                self._iterator = None
+                return
+
+    def _iter_source(self):
+        index = 0
+        while True:
+            self._fill(index)
+            if index >= len(self._source):
+                return
+            yield self._source[index]
+            index += 1
+
+    def __len__(self):
+        self._fill()
+        if _is_queryset(self._source) and self._source.query.high_mark is None:
+            return self._source.count()
+        # Sliced querysets are bounded, so are evaluated, rather than
+        # counted, as the rows will usually be iterated over next.
+        return len(self._source)
+
+    def __iter__(self):
+        if self._iterator is None:
+            # Iterating a queryset directly, rather than indexing it, means
+            # that its rows are fetched using a single query.
+            source = self._source
+        else:
+            source = self._iter_source()
+        for index, item in enumerate(source):
+            if index not in self._cache:
+                self._cache[index] = self._serialize(item)
+            yield self._cache[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop = index.start or 0, index.stop
+            if stop is not None and start >= 0 and stop >= 0:
+                self._fill(stop - 1)
+            else:
+                self._fill()
+            ret = LazySerializedList(self._source[index], self._serialize)
+            if not _is_queryset(self._source):
+                indices = range(*index.indices(len(self._source)))
+                ret._cache = dict([(new, self._cache[old])
+                                   for (new, old) in enumerate(indices)
+                                   if old in self._cache])
+            return ret
+
+        if index < 0:
+            index += len(self)
+        if index not in self._cache:
+            self._fill(index)
+            self._cache[index] = self._serialize(self._source[index])
+        return self._cache[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, LazySerializedList)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        if ret is NotImplemented:
+            return ret
+        return not ret
 
 
 class DictWriter(csv.DictWriter):
@@ -112,3 +230,54 @@ class DictWriter(csv.DictWriter):
             else:
                 d[fieldname] = self._stringify(self.restval, self.encoding)
         self.writer.writerow(d)
+
+
+def compress_iter(chunks, method='gzip', compresslevel=9):
+    """
+    Given an iterator over chunks of output, return an iterator over
+    the compressed output, using either 'gzip' or 'bz2' compression.
+    """
+    if method == 'gzip':
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                      16 + zlib.MAX_WBITS)
+    elif method == 'bz2':
+        compressor = bz2.BZ2Compressor(compresslevel)
+    else:
+        raise ValueError("Unknown compression method '%s'" % method)
+
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    data = compressor.flush()
+    if data:
+        yield data
+
+
+class DigestIterator(object):
+    """
+    Wraps an iterator over chunks of output, computing a digest of the
+    output as it is consumed, using any algorithm that `hashlib` supports.
+    """
+    def __init__(self, chunks, algorithm='md5'):
+        self.chunks = iter(chunks)
+        self.hash = hashlib.new(algorithm)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        chunk = self.chunks.next()
+        if isinstance(chunk, unicode):
+            self.hash.update(chunk.encode('utf-8'))
+        else:
+            self.hash.update(chunk)
+        return chunk
+
+    def hexdigest(self):
+        """
+        The digest of the output consumed so far.
+        """
+        return self.hash.hexdigest()
@@ -0,0 +1,97 @@
+"""
+Does the work that serializers otherwise do lazily on first use, such as
+importing renderers, loading model metadata and building field plans, so that
+the first request a process handles is as fast as later ones.
+
+Django 1.4 has no signal for when the project has been loaded, so `warm_up()`
+should be called explicitly, eg. at the end of the project's `wsgi.py`.
+"""
+from django.db import models
+from django.db.models.query import QuerySet
+from serializers.fields import _get_field_converter, _protected_types
+from serializers.serializer import BaseSerializer, _import_string
+
+
+def _get_subclasses(cls):
+    ret = []
+    for subclass in cls.__subclasses__():
+        ret.append(subclass)
+        ret.extend(_get_subclasses(subclass))
+    return ret
+
+
+def _get_related_model(obj, field_name):
+    """
+    Return the model that the named field of a model instance relates to,
+    or `None`.
+    """
+    try:
+        field, model, direct, m2m = obj._meta.get_field_by_name(field_name)
+    except Exception:
+        return None
+    if not direct:
+        return field.model
+    elif field.rel:
+        return field.rel.to
+    return None
+
+
+def _warm_up_model(model):
+    """
+    Load the metadata caches that `Options` otherwise fills on first use.
+    """
+    # Builds the caches of fields, related objects, and the name map that
+    # `get_field_by_name` uses.
+    model._meta.get_all_field_names()
+
+
+def _warm_up_plans(serializer, obj, seen):
+    """
+    Build the field plans for a model instance, and those of any nested
+    serializers, as serializing it would.
+    """
+    plan = serializer._get_field_plan(obj)
+    if serializer.opts.compile:
+        serializer._get_compiled_plan(obj)
+    for field_name, key, field in plan:
+        if not isinstance(field, BaseSerializer):
+            continue
+        field._set_parent(obj, field_name, serializer)
+        if field.source == '*':
+            _warm_up_plans(field, obj, seen)
+            continue
+        related = _get_related_model(obj, field.source or field_name)
+        if related is not None and related not in seen:
+            _warm_up_plans(field, related(), seen + (related,))
+
+
+def warm_up(serializers=()):
+    """
+    Import the renderers of every serializer class, load the metadata of
+    every installed model, and fill the type dispatch caches.
+
+    To build field plans ahead of time, pass a list of `(serializer, model)`
+    pairs.  Plans are shared by instances of the same class created with the
+    same options, and any generated code is shared by all instances, so the
+    serializers passed in may be created just for warming up.
+    """
+    all_models = models.get_models()
+    for model in all_models:
+        _warm_up_model(model)
+
+    for cls in _protected_types + (str, unicode):
+        _get_field_converter(cls)
+
+    for serializer_class in _get_subclasses(BaseSerializer):
+        for renderer_class in serializer_class.renderer_classes.values():
+            if isinstance(renderer_class, basestring):
+                _import_string(renderer_class)
+        # Type converters only depend on the class, so the constructor, which
+        # may require arguments, isn't called.
+        instance = serializer_class.__new__(serializer_class)
+        for cls in all_models + [QuerySet]:
+            if cls not in instance._type_dispatch:
+                instance._type_dispatch[cls] = instance._get_type_converter(cls)
+
+    for serializer, model in serializers:
+        _warm_up_plans(serializer, model(), (model,))
@@ -1,8 +1,17 @@
+import os
+import tempfile
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': ':memory:',
     },
+    # A file based database, that worker processes can share.
+    'files': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'files.db',
+        'TEST_NAME': os.path.join(tempfile.gettempdir(), 'serializers_test.db'),
+    },
 }
 
 INSTALLED_APPS = (